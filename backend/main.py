@@ -4,23 +4,31 @@ Home Broker Simulator - Main FastAPI Application
 
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Cookie, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, Dict, List, Any
-import uuid
+from fastapi.responses import ORJSONResponse
+from typing import Optional, Dict, List, Any, Tuple
+from collections import defaultdict
 import json
 import asyncio
+import secrets
+import sys
 import logging
-from datetime import datetime
+import os
+import time
 import websockets
+import numpy as np
+import msgpack
 
-from models import Order, OrderType, OrderSide, Fill, User, OrderBook, BookLevel
-from order_matching import OrderMatchingEngine
+from models import Order, OrderType, OrderSide, Fill, User, OrderBook, BookLevel, PlaceOrderRequest, UpdateOrderRequest
+from order_matching import AsyncOrderMatchingEngine, MARKET_USER_ID, WORKER_ID, new_order_id
+from redis_engine import RedisOrderMatchingEngine
 from websocket_manager import ConnectionManager
+from user_store import UserStore, RedisUserStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Home Broker Simulator", version="1.0.0")
+app = FastAPI(title="Home Broker Simulator", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -40,27 +48,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Debug middleware to log all requests
-@app.middleware("http")
-async def debug_requests(request, call_next):
-    logger.info(f"Request: {request.method} {request.url}")
-    logger.info(f"Headers: {dict(request.headers)}")
-    response = await call_next(request)
-    logger.info(f"Response status: {response.status_code}")
-    return response
+# Debug middleware to log all requests (only installed when debug logging is enabled)
+if logger.isEnabledFor(logging.DEBUG):
+    @app.middleware("http")
+    async def debug_requests(request, call_next):
+        logger.debug("Request: %s %s", request.method, request.url)
+        logger.debug("Headers: %s", request.headers)
+        response = await call_next(request)
+        logger.debug("Response status: %s", response.status_code)
+        return response
 
 # Global state
-users: Dict[str, User] = {}
-order_matching_engine = OrderMatchingEngine()
-connection_manager = ConnectionManager()
-
-
-def get_or_create_user(response: Response, user_id: Optional[str] = Cookie(None)) -> tuple[User, str]:
+# Set REDIS_URL to share user balances, the order book and WebSocket fan-out between workers
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    import redis.asyncio
+    redis_client = redis.asyncio.from_url(REDIS_URL, decode_responses=True)
+    user_store = RedisUserStore(redis_client)
+    order_matching_engine = RedisOrderMatchingEngine(redis_client)
+    # Workers only diff against their own broadcasts, so deltas could miss
+    # changes broadcast by other workers: always send full snapshots instead.
+    # Pub/sub also carries binary frames, so it gets a client that does not decode them.
+    connection_manager = ConnectionManager(snapshot_interval=0.0, redis=redis.asyncio.from_url(REDIS_URL))
+else:
+    redis_client = None
+    user_store = UserStore()
+    order_matching_engine = AsyncOrderMatchingEngine()
+    connection_manager = ConnectionManager()
+
+# Seconds a worker keeps ownership of the market data feed without renewing it
+MARKET_DATA_OWNER_TTL = 10.0
+
+
+async def _current_order_book() -> dict:
+    return await order_matching_engine.get_order_book()
+
+
+async def get_or_create_user(response: Response, user_id: Optional[str] = Cookie(None)) -> tuple[User, str]:
     """Get existing user or create new one based on cookie"""
-    if not user_id or user_id not in users:
-        user_id = str(uuid.uuid4())
-        users[user_id] = User(
-            id=user_id,
+    user = await user_store.get(user_id) if user_id else None
+    if user is None:
+        user_id = secrets.token_urlsafe(16)
+        user = await user_store.create(
+            user_id,
             cash_balance=10000.0,  # Starting with $10,000
             asset_balance=0.0,     # Starting with 0 shares
         )
@@ -73,9 +103,10 @@ def get_or_create_user(response: Response, user_id: Optional[str] = Cookie(None)
             secure=False,      # Set to True in production with HTTPS
             samesite="lax"
         )
-        logger.info(f"Created new user: {user_id}")
+        logger.info("Created new user: %s", user_id)
     
-    return users[user_id], user_id
+    # Interned so that orders, fills and connection lookups all share one key object
+    return user, sys.intern(user_id)
 
 
 @app.on_event("startup")
@@ -83,6 +114,10 @@ async def startup_event():
     """Start background tasks on startup"""
     # Start market data feed simulation
     asyncio.create_task(simulate_market_data())
+    # Start coalesced order book broadcasts
+    connection_manager.start_book_flusher(_current_order_book)
+    # Start forwarding messages published by other workers
+    await connection_manager.start_pubsub()
     logger.info("Home Broker Simulator started")
 
 
@@ -100,13 +135,13 @@ async def get_user_info(response: Response, user_data=Depends(get_or_create_user
         "user_id": user_id,
         "cash_balance": user.cash_balance,
         "asset_balance": user.asset_balance,
-        "total_value": user.cash_balance + (user.asset_balance * order_matching_engine.get_last_price())
+        "total_value": user.cash_balance + (user.asset_balance * await order_matching_engine.get_last_price())
     }
 
 
 @app.post("/api/orders")
 async def place_order(
-    order_data: dict,
+    order_request: PlaceOrderRequest,
     response: Response,
     user_data=Depends(get_or_create_user)
 ):
@@ -114,37 +149,40 @@ async def place_order(
     user, user_id = user_data
     
     try:
-        print(order_data)
+        logger.debug("order %s", order_request)
         # Create order object
         order = Order(
-            id=str(uuid.uuid4()),
+            id=new_order_id(),
             user_id=user_id,
             symbol="BTCUSD",  # Single asset for now
-            order_type=OrderType(order_data["order_type"]),
-            side=OrderSide(order_data["side"]),
-            quantity=float(order_data["quantity"]),
-            price=float(order_data.get("price", 0)) if order_data.get("price") else None,
-            timestamp=datetime.utcnow()
+            order_type=order_request.order_type,
+            side=order_request.side,
+            quantity=order_request.quantity,
+            price=order_request.price,
+            timestamp=time.time_ns()
         )
         
         # Validate order against user balance
-        if not _validate_order_balance(order, user):
+        if not await _validate_order_balance(order, user):
             raise HTTPException(status_code=400, detail="Insufficient balance")
         
         # Process order through matching engine
-        fills = order_matching_engine.process_order(order)
+        fills = await order_matching_engine.process_order(order)
         
-        # Process fills and update balances
+        # Process fills, update balances and notify the users involved
+        messages = []
         for fill in fills:
-            await _process_fill(fill)
+            _, fill_messages = await _process_fill(fill)
+            messages.extend(fill_messages)
+        await _send_to_users(messages)
         
-        # Broadcast order book update
-        await connection_manager.broadcast_order_book(order_matching_engine.get_order_book())
+        # Schedule order book broadcast
+        connection_manager.mark_book_dirty()
         
         return {"order_id": order.id, "status": "submitted", "fills": len(fills)}
         
     except Exception as e:
-        logger.error(f"Error placing order: {e}")
+        logger.error("Error placing order: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -158,25 +196,25 @@ async def cancel_order(
     user, user_id = user_data
     
     try:
-        success = order_matching_engine.cancel_order(order_id, user_id)
+        success = await order_matching_engine.cancel_order(order_id, user_id)
         
         if not success:
             raise HTTPException(status_code=404, detail="Order not found or already filled")
         
-        # Broadcast order book update
-        await connection_manager.broadcast_order_book(order_matching_engine.get_order_book())
+        # Schedule order book broadcast
+        connection_manager.mark_book_dirty()
         
         return {"status": "cancelled", "order_id": order_id}
         
     except Exception as e:
-        logger.error(f"Error canceling order: {e}")
+        logger.error("Error canceling order: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.put("/api/orders/{order_id}")
 async def update_order(
     order_id: str,
-    update_data: dict,
+    update_request: UpdateOrderRequest,
     response: Response,
     user_data=Depends(get_or_create_user)
 ):
@@ -184,23 +222,20 @@ async def update_order(
     user, user_id = user_data
     
     try:
-        new_price = update_data.get("price")
-        new_quantity = update_data.get("quantity")
-        
-        success = order_matching_engine.update_order(
-            order_id, user_id, new_price, new_quantity
+        success = await order_matching_engine.update_order(
+            order_id, user_id, update_request.price, update_request.quantity
         )
         
         if not success:
             raise HTTPException(status_code=404, detail="Order not found or cannot be updated")
         
-        # Broadcast order book update
-        await connection_manager.broadcast_order_book(order_matching_engine.get_order_book())
+        # Schedule order book broadcast
+        connection_manager.mark_book_dirty()
         
         return {"status": "updated", "order_id": order_id}
         
     except Exception as e:
-        logger.error(f"Error updating order: {e}")
+        logger.error("Error updating order: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -208,7 +243,7 @@ async def update_order(
 async def get_open_orders(response: Response, user_data=Depends(get_or_create_user)):
     """Get user's open orders"""
     user, user_id = user_data
-    orders = order_matching_engine.get_user_orders(user_id)
+    orders = await order_matching_engine.get_user_orders(user_id)
     
     return {
         "orders": [
@@ -222,7 +257,7 @@ async def get_open_orders(response: Response, user_data=Depends(get_or_create_us
                 "remaining_quantity": order.remaining_quantity,
                 "price": order.price,
                 "status": order.status.value,
-                "timestamp": order.timestamp.isoformat()
+                "timestamp": order.timestamp
             }
             for order in orders
         ]
@@ -233,7 +268,7 @@ async def get_open_orders(response: Response, user_data=Depends(get_or_create_us
 async def get_trade_history(response: Response, user_data=Depends(get_or_create_user)):
     """Get user's trade history"""
     user, user_id = user_data
-    fills = order_matching_engine.get_user_fills(user_id)
+    fills = await order_matching_engine.get_user_fills(user_id)
     
     return {
         "trades": [
@@ -244,7 +279,7 @@ async def get_trade_history(response: Response, user_data=Depends(get_or_create_
                 "side": fill.get_side_for_user(user_id).value,
                 "quantity": fill.quantity,
                 "price": fill.price,
-                "timestamp": fill.timestamp.isoformat()
+                "timestamp": fill.timestamp
             }
             for fill in fills
         ]
@@ -254,55 +289,57 @@ async def get_trade_history(response: Response, user_data=Depends(get_or_create_
 @app.get("/api/orderbook")
 async def get_order_book():
     """Get current order book"""
-    return order_matching_engine.get_order_book()
+    return await _current_order_book()
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket, user_id: Optional[str] = Cookie(None)):
     """WebSocket endpoint for real-time updates"""
-    if not user_id or user_id not in users:
-        user_id = str(uuid.uuid4())
-        users[user_id] = User(
-            id=user_id,
+    user = await user_store.get(user_id) if user_id else None
+    if user is None:
+        user_id = secrets.token_urlsafe(16)
+        user = await user_store.create(
+            user_id,
             cash_balance=10000.0,
             asset_balance=0.0,
         )
     
-    await connection_manager.connect(websocket, user_id)
+    user_id = await connection_manager.connect(websocket, user_id)
     
     try:
         # Send initial data
-        await websocket.send_json({
+        await connection_manager.send(websocket, {
             "type": "user_info",
             "data": {
                 "user_id": user_id,
-                "cash_balance": users[user_id].cash_balance,
-                "asset_balance": users[user_id].asset_balance,
+                "cash_balance": user.cash_balance,
+                "asset_balance": user.asset_balance,
             }
         })
         
-        await websocket.send_json({
-            "type": "order_book",
-            "data": order_matching_engine.get_order_book()
-        })
+        await connection_manager.send_order_book_snapshot(websocket, _current_order_book)
+        
+        # Idle connections are kept alive by protocol-level pings; wait until
+        # the client closes the connection or a failed send drops it
+        await connection_manager.wait_closed(websocket)
         
-        # Keep connection alive and handle messages
-        while True:
-            await websocket.receive_text()
-            
     except WebSocketDisconnect:
+        pass
+    finally:
         connection_manager.disconnect(websocket, user_id)
+        # Close the socket if the client is still there, so it notices the drop
+        await connection_manager.close(websocket)
 
 
-def _validate_order_balance(order: Order, user: User) -> bool:
+async def _validate_order_balance(order: Order, user: User) -> bool:
     """Validate if user has sufficient balance for the order"""
-    if order.side == OrderSide.BUY:
-        if order.order_type == OrderType.MARKET:
+    if order.side is OrderSide.BUY:
+        if order.order_type is OrderType.MARKET:
             # For market orders, check against current ask price
-            best_ask = order_matching_engine.get_best_ask()
+            best_ask = await order_matching_engine.get_best_ask()
             if best_ask is None:
                 # No asks available, use a high default price for validation
-                best_ask = order_matching_engine.get_last_price() * 1.1  # 10% above last price
+                best_ask = await order_matching_engine.get_last_price() * 1.1  # 10% above last price
             required_cash = order.quantity * best_ask
         else:
             # For limit orders, check against limit price
@@ -314,164 +351,179 @@ def _validate_order_balance(order: Order, user: User) -> bool:
         return True
 
 
-async def _process_fill(fill: Fill):
-    """Process a fill and update user balances"""
-    buyer_id = fill.buyer_id
-    seller_id = fill.seller_id
+async def _process_fill(fill: Fill) -> Tuple[Dict[str, User], List[Tuple[str, dict]]]:
+    """
+    Process a fill and update user balances. Returns the updated users and the
+    (user_id, message) fill notifications to send them.
+    """
+    # Update balances (the synthetic market counterparty has no account)
+    updated_users = await user_store.apply_fill(fill.buyer_id, fill.seller_id, fill.quantity, fill.price)
     
-    # Update buyer balance (skip if it's a synthetic market fill)
-    if buyer_id in users and buyer_id != "MARKET":
-        users[buyer_id].cash_balance -= fill.quantity * fill.price
-        users[buyer_id].asset_balance += fill.quantity
+    # Notify relevant users (only real users, not synthetic market)
+    messages = []
+    for user_id, side in ((fill.buyer_id, "buy"), (fill.seller_id, "sell")):
+        if user_id in updated_users:
+            messages.append((user_id, {
+                "type": "fill",
+                "data": {
+                    "id": fill.id,
+                    "side": side,
+                    "quantity": fill.quantity,
+                    "price": fill.price,
+                    "timestamp": fill.timestamp,
+                    "new_cash_balance": updated_users[user_id].cash_balance,
+                    "new_asset_balance": updated_users[user_id].asset_balance,
+                }
+            }))
     
-    # Update seller balance (skip if it's a synthetic market fill)  
-    if seller_id in users and seller_id != "MARKET":
-        users[seller_id].cash_balance += fill.quantity * fill.price
-        users[seller_id].asset_balance -= fill.quantity
+    return updated_users, messages
+
+
+async def _send_to_users(messages: List[Tuple[str, dict]]):
+    """Send (user_id, message) pairs concurrently across users, in order for each user"""
+    user_messages: Dict[str, List[dict]] = defaultdict(list)
+    for user_id, message in messages:
+        user_messages[user_id].append(message)
     
-    # Broadcast fill to relevant users (only real users, not synthetic market)
-    if buyer_id != "MARKET" and buyer_id in users:
-        await connection_manager.send_to_user(buyer_id, {
-            "type": "fill",
-            "data": {
-                "id": fill.id,
-                "side": "buy",
-                "quantity": fill.quantity,
-                "price": fill.price,
-                "timestamp": fill.timestamp.isoformat(),
-                "new_cash_balance": users[buyer_id].cash_balance,
-                "new_asset_balance": users[buyer_id].asset_balance,
-            }
-        })
+    async def send_all(user_id: str, messages: List[dict]):
+        for message in messages:
+            await connection_manager.send_to_user(user_id, message)
     
-    if seller_id != "MARKET" and seller_id in users:
-        await connection_manager.send_to_user(seller_id, {
-            "type": "fill",
-            "data": {
-                "id": fill.id,
-                "side": "sell",
-                "quantity": fill.quantity,
-                "price": fill.price,
-                "timestamp": fill.timestamp.isoformat(),
-                "new_cash_balance": users[seller_id].cash_balance,
-                "new_asset_balance": users[seller_id].asset_balance,
-            }
-        })
+    results = await asyncio.gather(
+        *(send_all(user_id, messages) for user_id, messages in user_messages.items()),
+        return_exceptions=True
+    )
+    
+    for user_id, result in zip(user_messages, results):
+        if isinstance(result, Exception):
+            logger.error("Error sending to user %s: %s", user_id, result)
+
+
+def _generate_market_depth(rng: np.random.Generator, base_price: float, depth: int = 5) -> OrderBook:
+    """Generate fake bid/ask depth around base_price in one vectorized pass"""
+    level_numbers = np.arange(1, depth + 1)
+    
+    # Level i sits (i + 1) * U(10, 50) away from the base price
+    bid_prices = base_price - level_numbers * rng.uniform(10, 50, depth)
+    ask_prices = base_price + level_numbers * rng.uniform(10, 50, depth)
+    
+    # Round to tick size of 10
+    bid_prices = np.round(bid_prices / 10) * 10
+    ask_prices = np.round(ask_prices / 10) * 10
+    
+    return OrderBook(
+        symbol="BTCUSD",
+        bid_prices=bid_prices,
+        bid_quantities=rng.uniform(0.1, 2.0, depth),
+        ask_prices=ask_prices,
+        ask_quantities=rng.uniform(0.1, 2.0, depth),
+    )
+
+
+async def _owns_market_data() -> bool:
+    """Claim or renew ownership of the market data feed (always owned without Redis)"""
+    if redis_client is None:
+        return True
+    
+    key = "market_data:owner"
+    ttl_ms = int(MARKET_DATA_OWNER_TTL * 1000)
+    if await redis_client.set(key, WORKER_ID, nx=True, px=ttl_ms):
+        return True
+    if await redis_client.get(key) == WORKER_ID:
+        await redis_client.pexpire(key, ttl_ms)
+        return True
+    return False
 
 
 async def simulate_market_data():
     """Simulate market data feed (like Binance WebSocket)"""
-    import random
+    rng = np.random.default_rng()
     
     base_price = 100000.0  # Starting BTC price
     
     while True:
         try:
+            # Only one worker drives the shared book with market data
+            if not await _owns_market_data():
+                await asyncio.sleep(2)
+                continue
+            
             # Simulate price movement
-            price_change = random.uniform(-100, 100)
+            price_change = rng.uniform(-100, 100)
             base_price = max(1000, base_price + price_change)
             
             # Round base price to tick size of 10
             base_price = round(base_price / 10) * 10
             
-            # Create fake book depth
-            bid_levels = []
-            ask_levels = []
-            
-            for i in range(5):  # 5 levels each side
-                bid_price = base_price - (i + 1) * random.uniform(10, 50)  # Changed to 10 minimum
-                ask_price = base_price + (i + 1) * random.uniform(10, 50)  # Changed to 10 minimum
-                bid_size = random.uniform(0.1, 2.0)
-                ask_size = random.uniform(0.1, 2.0)
-                
-                # Round to tick size of 10
-                bid_price = round(bid_price / 10) * 10
-                ask_price = round(ask_price / 10) * 10
-                
-                bid_levels.append(BookLevel(price=bid_price, quantity=bid_size))
-                ask_levels.append(BookLevel(price=ask_price, quantity=ask_size))
+            # Create fake book depth (5 levels each side)
+            market_book = _generate_market_depth(rng, base_price)
             
             # Update the order book with market data and get any resulting fills
-            fills = order_matching_engine.update_market_data(bid_levels, ask_levels)
+            fills = await order_matching_engine.update_market_data(market_book.bids, market_book.asks)
             
-            # Debug logging
             if fills:
-                logger.info(f"Market data update resulted in {len(fills)} fills")
+                logger.info("Market data update resulted in %d fills", len(fills))
+            
+            # Debug logging (looks up the orders of every user involved, so only when enabled)
+            if fills and logger.isEnabledFor(logging.DEBUG):
                 for fill in fills:
-                    logger.info(f"Fill: {fill.buyer_id} bought {fill.quantity} at {fill.price}")
+                    logger.debug("Fill: %s bought %s at %s", fill.buyer_id, fill.quantity, fill.price)
                     # Check if the order was actually updated to filled status
-                    if fill.buyer_id != "MARKET":
-                        buyer_orders = order_matching_engine.get_user_orders(fill.buyer_id)
+                    if fill.buyer_id != MARKET_USER_ID:
+                        buyer_orders = await order_matching_engine.get_user_orders(fill.buyer_id)
                         for order in buyer_orders:
                             if order.id == fill.buyer_order_id:
-                                logger.info(f"Order {order.id} status after fill: {order.status}")
-                    if fill.seller_id != "MARKET":
-                        seller_orders = order_matching_engine.get_user_orders(fill.seller_id)
+                                logger.debug("Order %s status after fill: %s", order.id, order.status)
+                    if fill.seller_id != MARKET_USER_ID:
+                        seller_orders = await order_matching_engine.get_user_orders(fill.seller_id)
                         for order in seller_orders:
                             if order.id == fill.seller_order_id:
-                                logger.info(f"Order {order.id} status after fill: {order.status}")
+                                logger.debug("Order %s status after fill: %s", order.id, order.status)
             
             # Process any fills from limit orders matched against market data
+            # and keep the latest balances of every user touched by them
+            touched_users: Dict[str, User] = {}
+            messages = []
             for fill in fills:
-                await _process_fill(fill)
+                updated_users, fill_messages = await _process_fill(fill)
+                touched_users.update(updated_users)
+                messages.extend(fill_messages)
             
             # Broadcast order book update if there were fills
             if fills:
-                await connection_manager.broadcast_order_book(order_matching_engine.get_order_book())
+                connection_manager.mark_book_dirty()
                 
-                # Also broadcast updated user data for each user involved in fills
-                for fill in fills:
-                    if fill.buyer_id != "MARKET" and fill.buyer_id in users:
-                        # Send updated balance to buyer
-                        await connection_manager.send_to_user(fill.buyer_id, {
-                            "type": "balance_update",
-                            "data": {
-                                "cash_balance": users[fill.buyer_id].cash_balance,
-                                "asset_balance": users[fill.buyer_id].asset_balance
-                            }
-                        })
-                        # Send updated orders to buyer
-                        user_orders = order_matching_engine.get_user_orders(fill.buyer_id)
-                        await connection_manager.send_to_user(fill.buyer_id, {
-                            "type": "orders_update", 
-                            "data": [order.to_dict() for order in user_orders]
-                        })
-                        
-                    if fill.seller_id != "MARKET" and fill.seller_id in users:
-                        # Send updated balance to seller
-                        await connection_manager.send_to_user(fill.seller_id, {
-                            "type": "balance_update",
-                            "data": {
-                                "cash_balance": users[fill.seller_id].cash_balance,
-                                "asset_balance": users[fill.seller_id].asset_balance
-                            }
-                        })
-                        # Send updated orders to seller
-                        user_orders = order_matching_engine.get_user_orders(fill.seller_id)
-                        await connection_manager.send_to_user(fill.seller_id, {
-                            "type": "orders_update",
-                            "data": [order.to_dict() for order in user_orders]
-                        })
+                # Follow the fills with one combined balance + orders update per user
+                for user_id, user in touched_users.items():
+                    user_orders = await order_matching_engine.get_user_orders(user_id)
+                    messages.append((user_id, {
+                        "type": "account_update",
+                        "data": {
+                            "cash_balance": user.cash_balance,
+                            "asset_balance": user.asset_balance,
+                            "orders": [order.to_dict() for order in user_orders]
+                        }
+                    }))
+                
+                await _send_to_users(messages)
             
-            # Broadcast to all connected clients
-            await connection_manager.broadcast({
-                "type": "market_data",
-                "data": {
-                    "symbol": "BTCUSD",
-                    "price": base_price,
-                    "bids": [(level.price, level.quantity) for level in bid_levels],
-                    "asks": [(level.price, level.quantity) for level in ask_levels],
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-            })
+            # Broadcast to all connected clients as a compact binary frame
+            await connection_manager.broadcast_bytes(msgpack.packb({
+                "type": "md",
+                "s": market_book.symbol,
+                "p": base_price,
+                "b": market_book.bid_levels(),
+                "a": market_book.ask_levels(),
+                "t": time.time_ns()
+            }))
             
             await asyncio.sleep(2)  # Update every 2 seconds
             
         except Exception as e:
-            logger.error(f"Error in market data simulation: {e}")
+            logger.error("Error in market data simulation: %s", e)
             await asyncio.sleep(5)
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    uvicorn.run(app, host="0.0.0.0", port=8001, ws_ping_interval=20, ws_ping_timeout=20)
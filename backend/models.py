@@ -2,11 +2,12 @@
 Data Models for Home Broker Simulator
 """
 
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, Field, model_validator
 from enum import Enum
 from typing import Optional, List
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+import numpy as np
 
 
 class OrderType(Enum):
@@ -26,14 +27,14 @@ class OrderStatus(Enum):
     CANCELLED = "cancelled"
 
 
-@dataclass
+@dataclass(slots=True)
 class BookLevel:
     """Order book level"""
     price: float
     quantity: float
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     """User data model"""
     id: str
@@ -41,7 +42,7 @@ class User:
     asset_balance: float
 
 
-@dataclass
+@dataclass(slots=True)
 class Order:
     """Order data model"""
     id: str
@@ -51,9 +52,11 @@ class Order:
     side: OrderSide
     quantity: float
     price: Optional[float]
-    timestamp: datetime
+    timestamp: int  # Nanoseconds since the epoch
     filled_quantity: float = 0.0
     status: OrderStatus = OrderStatus.PENDING
+    # (mutable fields, dict) from the last to_dict call
+    _dict_cache: Optional[tuple] = field(default=None, init=False, repr=False, compare=False)
     
     @property
     def remaining_quantity(self) -> float:
@@ -64,8 +67,12 @@ class Order:
         return self.filled_quantity >= self.quantity
     
     def to_dict(self) -> dict:
-        """Convert order to dictionary for JSON serialization"""
-        return {
+        """Convert order to dictionary for JSON serialization (cached until the order changes)"""
+        key = (self.quantity, self.price, self.filled_quantity, self.status)
+        if self._dict_cache is not None and self._dict_cache[0] == key:
+            return self._dict_cache[1]
+        
+        data = {
             "id": self.id,
             "user_id": self.user_id,
             "symbol": self.symbol,
@@ -73,15 +80,17 @@ class Order:
             "side": self.side.value,
             "quantity": self.quantity,
             "price": self.price,
-            "timestamp": self.timestamp.isoformat(),
+            "timestamp": self.timestamp,
             "filled_quantity": self.filled_quantity,
             "remaining_quantity": self.remaining_quantity,
             "status": self.status.value,
             "is_fully_filled": self.is_fully_filled
         }
+        self._dict_cache = (key, data)
+        return data
 
 
-@dataclass
+@dataclass(slots=True)
 class Fill:
     """Fill/Trade data model"""
     id: str
@@ -92,7 +101,7 @@ class Fill:
     symbol: str
     quantity: float
     price: float
-    timestamp: datetime
+    timestamp: int  # Nanoseconds since the epoch
     
     @property
     def order_id(self) -> str:
@@ -115,25 +124,51 @@ class Fill:
         return OrderSide.BUY
 
 
-@dataclass
+@dataclass(slots=True)
 class OrderBook:
-    """Order book data model"""
+    """Order book data model, one pair of parallel price/quantity arrays per side"""
     symbol: str
-    bids: List[BookLevel]
-    asks: List[BookLevel]
+    bid_prices: np.ndarray
+    bid_quantities: np.ndarray
+    ask_prices: np.ndarray
+    ask_quantities: np.ndarray
     last_price: Optional[float] = None
-    timestamp: Optional[datetime] = None
+    timestamp: Optional[int] = None
+    
+    @property
+    def bids(self) -> List[BookLevel]:
+        return [BookLevel(price=price, quantity=quantity)
+                for price, quantity in zip(self.bid_prices.tolist(), self.bid_quantities.tolist())]
+    
+    @property
+    def asks(self) -> List[BookLevel]:
+        return [BookLevel(price=price, quantity=quantity)
+                for price, quantity in zip(self.ask_prices.tolist(), self.ask_quantities.tolist())]
+    
+    def bid_levels(self) -> list:
+        """Bids as [price, quantity] rows, converted in one pass"""
+        return np.column_stack((self.bid_prices, self.bid_quantities)).tolist()
+    
+    def ask_levels(self) -> list:
+        """Asks as [price, quantity] rows, converted in one pass"""
+        return np.column_stack((self.ask_prices, self.ask_quantities)).tolist()
 
 
 class PlaceOrderRequest(BaseModel):
     """Request model for placing orders"""
-    order_type: str
-    side: str
-    quantity: float
-    price: Optional[float] = None
+    order_type: OrderType
+    side: OrderSide
+    quantity: float = Field(gt=0)
+    price: Optional[float] = Field(default=None, gt=0)
+    
+    @model_validator(mode="after")
+    def _limit_orders_need_a_price(self) -> "PlaceOrderRequest":
+        if self.order_type is OrderType.LIMIT and self.price is None:
+            raise ValueError("limit orders require a price")
+        return self
 
 
 class UpdateOrderRequest(BaseModel):
     """Request model for updating orders"""
-    price: Optional[float] = None
-    quantity: Optional[float] = None
+    price: Optional[float] = Field(default=None, gt=0)
+    quantity: Optional[float] = Field(default=None, gt=0)
@@ -2,39 +2,86 @@
 Order Matching Engine for Home Broker Simulator
 """
 
-from typing import Dict, List, Optional
-from collections import defaultdict
-import heapq
-from datetime import datetime
-import uuid
+from typing import Deque, Dict, List, Optional, Tuple
+from collections import defaultdict, deque
+import itertools
+import secrets
+import time
 import logging
 
+from sortedcontainers import SortedDict
+
 from models import Order, OrderType, OrderSide, OrderStatus, Fill, BookLevel, OrderBook
 
 logger = logging.getLogger(__name__)
 
+# Statuses of orders that can still rest in the book
+LIVE_STATUSES = (OrderStatus.PENDING, OrderStatus.PARTIAL)
+
+# Counterparty IDs of fills against synthetic market liquidity
+MARKET_USER_ID = "MARKET"
+MARKET_ORDER_ID = "MARKET_LIQUIDITY"
+
+# Price reported before the first trade
+DEFAULT_LAST_PRICE = 45000.0
+
+# Most recent fills kept in the engine-wide trade history
+FILL_HISTORY_SIZE = 100_000
+
+# Prefix that keeps IDs minted by different worker processes apart
+WORKER_ID = secrets.token_hex(4)
+# Orders and fills count separately, so each gets its own letter after the prefix
+_order_seq = itertools.count(1)
+_fill_seq = itertools.count(1)
+
+
+def new_order_id() -> str:
+    """Mint an order ID that is unique across workers"""
+    return f"{WORKER_ID}-O{next(_order_seq)}"
+
+
+def new_fill_id() -> str:
+    """Mint a fill ID that is unique across workers and never equal to an order ID"""
+    return f"{WORKER_ID}-F{next(_fill_seq)}"
+
 
 class OrderMatchingEngine:
     """
     Simple order matching engine with price-time priority
+    
+    The engine is single-writer and takes no locks: every call must come from
+    the event loop thread. Its methods are synchronous, so each order, cancel
+    or market data update runs to completion before the next one starts.
     """
     
     def __init__(self):
         # Order storage
         self.orders: Dict[str, Order] = {}
-        self.user_orders: Dict[str, List[str]] = defaultdict(list)
-        
-        # Order book - using heaps for efficient price-time priority
-        self.buy_orders = []   # Max heap (negative prices for max behavior)
-        self.sell_orders = []  # Min heap
-        
-        # Market data
-        self.market_bids: List[BookLevel] = []
-        self.market_asks: List[BookLevel] = []
+        # User ID -> that user's orders by ID, in placement order
+        self.user_orders: Dict[str, Dict[str, Order]] = defaultdict(dict)
+        
+        # Order book - price levels sorted ascending, each a FIFO queue of resting orders
+        self.bid_levels: SortedDict = SortedDict()  # Best bid is the last level
+        self.ask_levels: SortedDict = SortedDict()  # Best ask is the first level
+        # Price -> total remaining quantity of the live orders resting at that level
+        self._bid_depth: Dict[float, float] = {}
+        self._ask_depth: Dict[float, float] = {}
+        # Resting order ID -> price level queue holding it
+        self._by_id: Dict[str, Deque[Order]] = {}
+        # Number of live orders resting on each side of the book
+        self._resting_counts: Dict[OrderSide, int] = {OrderSide.BUY: 0, OrderSide.SELL: 0}
+        # Dead orders left behind in their queues, discarded once they reach the front
+        self._tombstones = 0
+        
+        # Market data - top of the market as plain floats (None when that side is empty)
+        self._market_best_bid: Optional[float] = None
+        self._market_best_ask: Optional[float] = None
         self.last_price: Optional[float] = None
+        # get_last_price() value, refreshed on every fill
+        self._last_price_cache: float = DEFAULT_LAST_PRICE
         
-        # Trade history
-        self.fills: List[Fill] = []
+        # Trade history (bounded, the oldest fills are dropped first)
+        self.fills: Deque[Fill] = deque(maxlen=FILL_HISTORY_SIZE)
         self.user_fills: Dict[str, List[Fill]] = defaultdict(list)
     
     def process_order(self, order: Order) -> List[Fill]:
@@ -42,163 +89,32 @@ class OrderMatchingEngine:
         Process an incoming order and return any fills
         """
         fills = []
+        # Every fill generated by this order shares one timestamp
+        now = time.time_ns()
         
         # Store the order
         self.orders[order.id] = order
-        self.user_orders[order.user_id].append(order.id)
+        self.user_orders[order.user_id][order.id] = order
         
-        if order.order_type == OrderType.MARKET:
-            fills = self._process_market_order(order)
+        if order.order_type is OrderType.MARKET:
+            fills = self._process_market_order(order, now)
         else:
-            fills = self._process_limit_order(order)
+            fills = self._process_limit_order(order, now)
         
-        # Store fills
-        for fill in fills:
-            self.fills.append(fill)
-            self.user_fills[fill.buyer_id].append(fill)
-            self.user_fills[fill.seller_id].append(fill)
-            self.last_price = fill.price
+        self._store_fills(fills)
         
-        logger.info(f"Processed order {order.id}, generated {len(fills)} fills")
+        logger.info("Processed order %s, generated %d fills", order.id, len(fills))
         return fills
     
-    def _process_market_order(self, order: Order) -> List[Fill]:
+    def _process_market_order(self, order: Order, now: int) -> List[Fill]:
         """Process a market order"""
-        fills = []
-        remaining_qty = order.quantity
+        # Match against resting orders on the opposite side at any price
+        fills = self._match_against_book(order, limit_price=None, now=now)
         
-        if order.side == OrderSide.BUY:
-            # Match against sell orders (asks)
-            while remaining_qty > 0 and self.sell_orders:
-                best_sell = heapq.heappop(self.sell_orders)
-                sell_price, sell_timestamp, sell_order_id = best_sell
-                
-                if sell_order_id not in self.orders:
-                    continue
-                    
-                sell_order = self.orders[sell_order_id]
-                if sell_order.status != OrderStatus.PENDING:
-                    continue
-                
-                # Calculate fill quantity
-                fill_qty = min(remaining_qty, sell_order.remaining_quantity)
-                
-                # Create fill
-                fill = Fill(
-                    id=str(uuid.uuid4()),
-                    buyer_order_id=order.id,
-                    seller_order_id=sell_order.id,
-                    buyer_id=order.user_id,
-                    seller_id=sell_order.user_id,
-                    symbol=order.symbol,
-                    quantity=fill_qty,
-                    price=sell_price,
-                    timestamp=datetime.utcnow()
-                )
-                fills.append(fill)
-                
-                # Update orders
-                order.filled_quantity += fill_qty
-                sell_order.filled_quantity += fill_qty
-                remaining_qty -= fill_qty
-                
-                # Update order status
-                if sell_order.is_fully_filled:
-                    sell_order.status = OrderStatus.FILLED
-                else:
-                    sell_order.status = OrderStatus.PARTIAL
-                    # Put back partial order
-                    heapq.heappush(self.sell_orders, best_sell)
-            
-            # If still has remaining quantity and no user orders, match against market data
-            if remaining_qty > 0 and self.market_asks:
-                # Use the best market ask price for execution
-                market_price = self.market_asks[0].price
-                
-                # Create a synthetic fill against market liquidity
-                fill = Fill(
-                    id=str(uuid.uuid4()),
-                    buyer_order_id=order.id,
-                    seller_order_id="MARKET_LIQUIDITY",  # Synthetic seller
-                    buyer_id=order.user_id,
-                    seller_id="MARKET",  # Market maker
-                    symbol=order.symbol,
-                    quantity=remaining_qty,
-                    price=market_price,
-                    timestamp=datetime.utcnow()
-                )
-                fills.append(fill)
-                
-                # Update order
-                order.filled_quantity += remaining_qty
-                remaining_qty = 0
-        
-        else:  # SELL
-            # Match against buy orders (bids)
-            while remaining_qty > 0 and self.buy_orders:
-                best_buy = heapq.heappop(self.buy_orders)
-                neg_buy_price, buy_timestamp, buy_order_id = best_buy
-                buy_price = -neg_buy_price
-                
-                if buy_order_id not in self.orders:
-                    continue
-                    
-                buy_order = self.orders[buy_order_id]
-                if buy_order.status != OrderStatus.PENDING:
-                    continue
-                
-                # Calculate fill quantity
-                fill_qty = min(remaining_qty, buy_order.remaining_quantity)
-                
-                # Create fill
-                fill = Fill(
-                    id=str(uuid.uuid4()),
-                    buyer_order_id=buy_order.id,
-                    seller_order_id=order.id,
-                    buyer_id=buy_order.user_id,
-                    seller_id=order.user_id,
-                    symbol=order.symbol,
-                    quantity=fill_qty,
-                    price=buy_price,
-                    timestamp=datetime.utcnow()
-                )
-                fills.append(fill)
-                
-                # Update orders
-                order.filled_quantity += fill_qty
-                buy_order.filled_quantity += fill_qty
-                remaining_qty -= fill_qty
-                
-                # Update order status
-                if buy_order.is_fully_filled:
-                    buy_order.status = OrderStatus.FILLED
-                else:
-                    buy_order.status = OrderStatus.PARTIAL
-                    # Put back partial order
-                    heapq.heappush(self.buy_orders, best_buy)
-            
-            # If still has remaining quantity and no user orders, match against market data
-            if remaining_qty > 0 and self.market_bids:
-                # Use the best market bid price for execution
-                market_price = self.market_bids[0].price
-                
-                # Create a synthetic fill against market liquidity
-                fill = Fill(
-                    id=str(uuid.uuid4()),
-                    buyer_order_id="MARKET_LIQUIDITY",  # Synthetic buyer
-                    seller_order_id=order.id,
-                    buyer_id="MARKET",  # Market maker
-                    seller_id=order.user_id,
-                    symbol=order.symbol,
-                    quantity=remaining_qty,
-                    price=market_price,
-                    timestamp=datetime.utcnow()
-                )
-                fills.append(fill)
-                
-                # Update order
-                order.filled_quantity += remaining_qty
-                remaining_qty = 0
+        # If still has remaining quantity and no user orders, match against market data
+        market_price = self._market_best_ask if order.side is OrderSide.BUY else self._market_best_bid
+        if order.remaining_quantity > 0 and market_price is not None:
+            fills.append(self._fill_against_market(order, market_price, now))
         
         # Update market order status
         if order.is_fully_filled:
@@ -208,188 +124,226 @@ class OrderMatchingEngine:
         
         return fills
     
-    def _process_limit_order(self, order: Order) -> List[Fill]:
+    def _process_limit_order(self, order: Order, now: int) -> List[Fill]:
         """Process a limit order"""
+        # Try to match against resting orders up to the limit price
+        fills = self._match_against_book(order, limit_price=order.price, now=now)
+        
+        # If not fully filled, try to match against market data
+        if order.remaining_quantity > 0:
+            if order.side is OrderSide.BUY:
+                market_ask = self._market_best_ask
+                if market_ask is not None and order.price >= market_ask:
+                    fills.append(self._fill_against_market(order, market_ask, now))
+            else:
+                market_bid = self._market_best_bid
+                if market_bid is not None and order.price <= market_bid:
+                    fills.append(self._fill_against_market(order, market_bid, now))
+        
+        # Update limit order status
+        if order.is_fully_filled:
+            order.status = OrderStatus.FILLED
+        elif order.filled_quantity > 0:
+            order.status = OrderStatus.PARTIAL
+        
+        # If still not fully filled, add to order book
+        if order.remaining_quantity > 0:
+            self._add_to_book(order)
+        
+        return fills
+    
+    def _match_against_book(self, order: Order, limit_price: Optional[float], now: int) -> List[Fill]:
+        """Match an order against resting orders on the opposite side (price-time priority)"""
         fills = []
-        remaining_qty = order.quantity
-        
-        if order.side == OrderSide.BUY:
-            # Try to match against existing sell orders
-            temp_sells = []
-            while remaining_qty > 0 and self.sell_orders:
-                best_sell = heapq.heappop(self.sell_orders)
-                sell_price, sell_timestamp, sell_order_id = best_sell
-                
-                # Check if we can match (buy price >= sell price)
-                if order.price < sell_price:
-                    heapq.heappush(self.sell_orders, best_sell)
-                    break
-                
-                if sell_order_id not in self.orders:
-                    continue
-                    
-                sell_order = self.orders[sell_order_id]
-                if sell_order.status != OrderStatus.PENDING:
-                    continue
-                
-                # Calculate fill quantity
-                fill_qty = min(remaining_qty, sell_order.remaining_quantity)
-                
-                # Create fill
-                fill = Fill(
-                    id=str(uuid.uuid4()),
-                    buyer_order_id=order.id,
-                    seller_order_id=sell_order.id,
-                    buyer_id=order.user_id,
-                    seller_id=sell_order.user_id,
-                    symbol=order.symbol,
-                    quantity=fill_qty,
-                    price=sell_price,  # Fill at the resting order's price
-                    timestamp=datetime.utcnow()
-                )
-                fills.append(fill)
-                
-                # Update orders
-                order.filled_quantity += fill_qty
-                sell_order.filled_quantity += fill_qty
-                remaining_qty -= fill_qty
-                
-                # Update order status
-                if sell_order.is_fully_filled:
-                    sell_order.status = OrderStatus.FILLED
-                else:
-                    sell_order.status = OrderStatus.PARTIAL
-                    heapq.heappush(self.sell_orders, best_sell)
+        is_buy = order.side is OrderSide.BUY
+        levels = self.ask_levels if is_buy else self.bid_levels
+        depth = self._ask_depth if is_buy else self._bid_depth
+        by_id = self._by_id
+        order_id = order.id
+        order_user_id = order.user_id
+        symbol = order.symbol
+        quantity = order.quantity
+        filled = order.filled_quantity
+        
+        resting_side = OrderSide.SELL if is_buy else OrderSide.BUY
+        swept = 0
+        
+        # Work through whole price levels, best first, keeping the running fill in locals
+        while filled < quantity and levels:
+            level_price, queue = levels.peekitem(0 if is_buy else -1)
             
-            # If not fully filled, try to match against market data
-            if remaining_qty > 0 and self.market_asks:
-                # Check if we can match against market ask
-                market_ask_price = self.market_asks[0].price
-                if order.price >= market_ask_price:
-                    # Create a synthetic fill against market liquidity
-                    fill = Fill(
-                        id=str(uuid.uuid4()),
-                        buyer_order_id=order.id,
-                        seller_order_id="MARKET_LIQUIDITY",
-                        buyer_id=order.user_id,
-                        seller_id="MARKET",
-                        symbol=order.symbol,
-                        quantity=remaining_qty,
-                        price=market_ask_price,
-                        timestamp=datetime.utcnow()
-                    )
-                    fills.append(fill)
-                    
-                    # Update order
-                    order.filled_quantity += remaining_qty
-                    remaining_qty = 0
-            
-            # If still not fully filled, add to order book
-            if remaining_qty > 0:
-                heapq.heappush(self.buy_orders, (
-                    -order.price,  # Negative for max heap behavior
-                    order.timestamp.timestamp(),
-                    order.id
-                ))
-        
-        else:  # SELL
-            # Try to match against existing buy orders
-            while remaining_qty > 0 and self.buy_orders:
-                best_buy = heapq.heappop(self.buy_orders)
-                neg_buy_price, buy_timestamp, buy_order_id = best_buy
-                buy_price = -neg_buy_price
-                
-                # Check if we can match (sell price <= buy price)
-                if order.price > buy_price:
-                    heapq.heappush(self.buy_orders, best_buy)
+            # Check if we can match (buy price >= sell price / sell price <= buy price)
+            if limit_price is not None:
+                if (is_buy and limit_price < level_price) or (not is_buy and limit_price > level_price):
                     break
-                
-                if buy_order_id not in self.orders:
-                    continue
-                    
-                buy_order = self.orders[buy_order_id]
-                if buy_order.status != OrderStatus.PENDING:
-                    continue
-                
-                # Calculate fill quantity
-                fill_qty = min(remaining_qty, buy_order.remaining_quantity)
-                
-                # Create fill
-                fill = Fill(
-                    id=str(uuid.uuid4()),
-                    buyer_order_id=buy_order.id,
-                    seller_order_id=order.id,
-                    buyer_id=buy_order.user_id,
-                    seller_id=order.user_id,
-                    symbol=order.symbol,
+            
+            while queue and filled < quantity:
+                resting_order = queue[0]
+                resting_quantity = resting_order.quantity
+                resting_filled = resting_order.filled_quantity
+                
+                # Calculate fill quantity (the smaller of the two remaining quantities)
+                remaining = quantity - filled
+                resting_remaining = resting_quantity - resting_filled
+                fill_qty = remaining if remaining < resting_remaining else resting_remaining
+                
+                # Create fill at the resting order's price
+                if is_buy:
+                    buyer_order_id, buyer_id = order_id, order_user_id
+                    seller_order_id, seller_id = resting_order.id, resting_order.user_id
+                else:
+                    buyer_order_id, buyer_id = resting_order.id, resting_order.user_id
+                    seller_order_id, seller_id = order_id, order_user_id
+                fills.append(Fill(
+                    id=new_fill_id(),
+                    buyer_order_id=buyer_order_id,
+                    seller_order_id=seller_order_id,
+                    buyer_id=buyer_id,
+                    seller_id=seller_id,
+                    symbol=symbol,
                     quantity=fill_qty,
-                    price=buy_price,  # Fill at the resting order's price
-                    timestamp=datetime.utcnow()
-                )
-                fills.append(fill)
+                    price=level_price,
+                    timestamp=now
+                ))
                 
                 # Update orders
-                order.filled_quantity += fill_qty
-                buy_order.filled_quantity += fill_qty
-                remaining_qty -= fill_qty
-                
-                # Update order status
-                if buy_order.is_fully_filled:
-                    buy_order.status = OrderStatus.FILLED
+                filled += fill_qty
+                resting_filled += fill_qty
+                resting_order.filled_quantity = resting_filled
+                depth[level_price] -= fill_qty
+                
+                # Update resting order status
+                if resting_filled >= resting_quantity:
+                    resting_order.status = OrderStatus.FILLED
+                    queue.popleft()
+                    del by_id[resting_order.id]
+                    swept += 1
+                    self._discard_tombstones(queue)
                 else:
-                    buy_order.status = OrderStatus.PARTIAL
-                    heapq.heappush(self.buy_orders, best_buy)
-            
-            # If not fully filled, try to match against market data
-            if remaining_qty > 0 and self.market_bids:
-                # Check if we can match against market bid
-                market_bid_price = self.market_bids[0].price
-                if order.price <= market_bid_price:
-                    # Create a synthetic fill against market liquidity
-                    fill = Fill(
-                        id=str(uuid.uuid4()),
-                        buyer_order_id="MARKET_LIQUIDITY",
-                        seller_order_id=order.id,
-                        buyer_id="MARKET",
-                        seller_id=order.user_id,
-                        symbol=order.symbol,
-                        quantity=remaining_qty,
-                        price=market_bid_price,
-                        timestamp=datetime.utcnow()
-                    )
-                    fills.append(fill)
-                    
-                    # Update order
-                    order.filled_quantity += remaining_qty
-                    remaining_qty = 0
+                    resting_order.status = OrderStatus.PARTIAL
             
-            # If still not fully filled, add to order book
-            if remaining_qty > 0:
-                heapq.heappush(self.sell_orders, (
-                    order.price,
-                    order.timestamp.timestamp(),
-                    order.id
-                ))
-        
-        # Update limit order status
-        if order.is_fully_filled:
-            order.status = OrderStatus.FILLED
-        elif order.filled_quantity > 0:
-            order.status = OrderStatus.PARTIAL
+            # Drop the level once it has been swept
+            if not queue:
+                del levels[level_price]
+                del depth[level_price]
         
+        order.filled_quantity = filled
+        self._resting_counts[resting_side] -= swept
         return fills
     
+    def _fill_against_market(self, order: Order, market_price: float, now: int) -> Fill:
+        """Fill the remaining quantity of an order against synthetic market liquidity"""
+        if order.side is OrderSide.BUY:
+            buyer_order_id, seller_order_id = order.id, MARKET_ORDER_ID
+            buyer_id, seller_id = order.user_id, MARKET_USER_ID
+        else:
+            buyer_order_id, seller_order_id = MARKET_ORDER_ID, order.id
+            buyer_id, seller_id = MARKET_USER_ID, order.user_id
+        
+        fill = Fill(
+            id=new_fill_id(),
+            buyer_order_id=buyer_order_id,
+            seller_order_id=seller_order_id,
+            buyer_id=buyer_id,
+            seller_id=seller_id,
+            symbol=order.symbol,
+            quantity=order.remaining_quantity,
+            price=market_price,
+            timestamp=now
+        )
+        
+        # Update order
+        order.filled_quantity += fill.quantity
+        return fill
+    
+    def _book_side(self, side: OrderSide) -> SortedDict:
+        """Get the price levels for a side of the book"""
+        return self.bid_levels if side is OrderSide.BUY else self.ask_levels
+    
+    def _book_depth(self, side: OrderSide) -> Dict[float, float]:
+        """Get the aggregated quantity per price level for a side of the book"""
+        return self._bid_depth if side is OrderSide.BUY else self._ask_depth
+    
+    def _best_level(self, side: OrderSide) -> Optional[Tuple[float, Deque[Order]]]:
+        """Get (price, queue) of the best level on a side of the book"""
+        levels = self._book_side(side)
+        if not levels:
+            return None
+        return levels.peekitem(-1 if side is OrderSide.BUY else 0)
+    
+    def _add_to_book(self, order: Order):
+        """Add an order to the back of its price level"""
+        levels = self._book_side(order.side)
+        
+        depth = self._book_depth(order.side)
+        
+        queue = levels.get(order.price)
+        if queue is None:
+            queue = levels[order.price] = deque()
+            depth[order.price] = order.remaining_quantity
+        else:
+            depth[order.price] += order.remaining_quantity
+        
+        queue.append(order)
+        self._by_id[order.id] = queue
+        self._resting_counts[order.side] += 1
+    
+    def _remove_from_book(self, order: Order):
+        """
+        Remove a resting order from its price level. The order's status must
+        already be dead: unless it is at the front of its queue it is left in
+        place as a tombstone instead of being searched for.
+        """
+        queue = self._by_id.pop(order.id, None)
+        if queue is None:
+            return
+        
+        self._book_depth(order.side)[order.price] -= order.remaining_quantity
+        self._resting_counts[order.side] -= 1
+        
+        if queue[0] is not order:
+            self._tombstones += 1
+            # Reclaim tombstones once they outnumber the live orders
+            if self._tombstones > len(self._by_id):
+                self._compact_book()
+            return
+        
+        queue.popleft()
+        self._discard_tombstones(queue)
+        
+        # Drop empty levels
+        if not queue:
+            del self._book_side(order.side)[order.price]
+            del self._book_depth(order.side)[order.price]
+    
+    def _discard_tombstones(self, queue: Deque[Order]):
+        """Pop dead orders off the front of a queue so it always starts with a live one"""
+        while queue and queue[0].status not in LIVE_STATUSES:
+            queue.popleft()
+            self._tombstones -= 1
+    
+    def _compact_book(self):
+        """Drop every tombstone from the book"""
+        for levels in (self.bid_levels, self.ask_levels):
+            for queue in levels.values():
+                live = [order for order in queue if order.status in LIVE_STATUSES]
+                # Refill in place, _by_id still points at these queues
+                queue.clear()
+                queue.extend(live)
+        self._tombstones = 0
+    
     def cancel_order(self, order_id: str, user_id: str) -> bool:
         """Cancel an order"""
         if order_id not in self.orders:
             return False
         
         order = self.orders[order_id]
-        if order.user_id != user_id or order.status in [OrderStatus.FILLED, OrderStatus.CANCELLED]:
+        if order.user_id != user_id or order.status not in LIVE_STATUSES:
             return False
         
         order.status = OrderStatus.CANCELLED
-        logger.info(f"Cancelled order {order_id}")
+        self._remove_from_book(order)
+        logger.info("Cancelled order %s", order_id)
         return True
     
     def update_order(self, order_id: str, user_id: str, new_price: Optional[float], new_quantity: Optional[float]) -> bool:
@@ -398,52 +352,40 @@ class OrderMatchingEngine:
             return False
         
         order = self.orders[order_id]
-        if order.user_id != user_id or order.status != OrderStatus.PENDING:
+        if order.user_id != user_id or order.status is not OrderStatus.PENDING:
             return False
         
-        # Remove the old order from the heap
-        self._remove_order_from_heap(order_id, order.side)
-        
-        # Update the order details
-        if new_price is not None:
-            order.price = new_price
-        if new_quantity is not None:
-            order.quantity = new_quantity
+        # Replace the order with an updated copy under the same ID; the old
+        # one is cancelled, which leaves it behind in the book as a tombstone
+        replacement = Order(
+            id=order.id,
+            user_id=order.user_id,
+            symbol=order.symbol,
+            order_type=order.order_type,
+            side=order.side,
+            quantity=order.quantity if new_quantity is None else new_quantity,
+            price=order.price if new_price is None else new_price,
+            timestamp=order.timestamp,
             # Reset filled quantity if quantity is updated
-            order.filled_quantity = 0
-        
-        # Add the updated order back to the heap
-        if order.side == OrderSide.BUY:
-            heapq.heappush(self.buy_orders, (
-                -order.price,  # Negative for max heap behavior
-                order.timestamp.timestamp(),
-                order.id
-            ))
-        else:
-            heapq.heappush(self.sell_orders, (
-                order.price,
-                order.timestamp.timestamp(),
-                order.id
-            ))
+            filled_quantity=order.filled_quantity if new_quantity is None else 0
+        )
+        resting = order.id in self._by_id
+        order.status = OrderStatus.CANCELLED
+        self._remove_from_book(order)
+        self.orders[order.id] = replacement
+        self.user_orders[order.user_id][order.id] = replacement
+        
+        # Add the updated order to the end of its (new) price level
+        if resting:
+            self._add_to_book(replacement)
         
-        logger.info(f"Updated order {order_id}")
+        logger.info("Updated order %s", order_id)
         return True
     
-    def _remove_order_from_heap(self, order_id: str, side: OrderSide):
-        """Remove an order from the appropriate heap"""
-        if side == OrderSide.BUY:
-            # Mark for removal by filtering out the order
-            self.buy_orders = [entry for entry in self.buy_orders if entry[2] != order_id]
-            heapq.heapify(self.buy_orders)
-        else:
-            # Mark for removal by filtering out the order
-            self.sell_orders = [entry for entry in self.sell_orders if entry[2] != order_id]
-            heapq.heapify(self.sell_orders)
-    
     def get_user_orders(self, user_id: str) -> List[Order]:
         """Get all orders for a user"""
-        order_ids = self.user_orders.get(user_id, [])
-        return [self.orders[order_id] for order_id in order_ids if order_id in self.orders]
+        orders = self.user_orders.get(user_id)
+        return list(orders.values()) if orders else []
     
     def get_user_fills(self, user_id: str) -> List[Fill]:
         """Get all fills for a user"""
@@ -451,67 +393,47 @@ class OrderMatchingEngine:
     
     def get_order_book(self) -> dict:
         """Get current order book state"""
-        # Aggregate orders by price level
-        bid_levels = defaultdict(float)
-        ask_levels = defaultdict(float)
-        
-        # Process buy orders
-        for neg_price, timestamp, order_id in self.buy_orders:
-            if order_id in self.orders:
-                order = self.orders[order_id]
-                if order.status == OrderStatus.PENDING:
-                    price = -neg_price
-                    bid_levels[price] += order.remaining_quantity
-        
-        # Process sell orders
-        for price, timestamp, order_id in self.sell_orders:
-            if order_id in self.orders:
-                order = self.orders[order_id]
-                if order.status == OrderStatus.PENDING:
-                    ask_levels[price] += order.remaining_quantity
-        
-        # Convert to sorted lists
-        bids = sorted([(price, qty) for price, qty in bid_levels.items()], reverse=True)[:10]
-        asks = sorted([(price, qty) for price, qty in ask_levels.items()])[:10]
+        # Aggregated quantities of the 10 best price levels
+        bid_depth, ask_depth = self._bid_depth, self._ask_depth
+        bids = [(price, bid_depth[price]) for price in reversed(self.bid_levels.keys()[-10:])]
+        asks = [(price, ask_depth[price]) for price in self.ask_levels.keys()[:10]]
         
         return {
             "symbol": "BTCUSD",
             "bids": bids,
             "asks": asks,
             "last_price": self.last_price,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": time.time_ns()
         }
     
     def get_best_bid(self) -> Optional[float]:
         """Get best bid price"""
-        if not self.buy_orders:
-            return None
-        return -self.buy_orders[0][0]
+        best_level = self._best_level(OrderSide.BUY)
+        return best_level[0] if best_level else None
     
     def get_best_ask(self) -> Optional[float]:
         """Get best ask price"""
-        if not self.sell_orders:
-            return None
-        return self.sell_orders[0][0]
+        best_level = self._best_level(OrderSide.SELL)
+        return best_level[0] if best_level else None
     
     def get_last_price(self) -> float:
         """Get last traded price"""
-        return self.last_price or 45000.0  # Default price
+        return self._last_price_cache
     
     def update_market_data(self, bids: List[BookLevel], asks: List[BookLevel]):
         """Update market data from external feed and check for limit order fills"""
-        self.market_bids = bids
-        self.market_asks = asks
+        self._market_best_bid = bids[0].price if bids else None
+        self._market_best_ask = asks[0].price if asks else None
         
         # Debug logging
-        pending_buy_orders = sum(1 for order in self.orders.values() 
-                               if order.side == 'buy' and order.status == OrderStatus.PENDING)
-        pending_sell_orders = sum(1 for order in self.orders.values() 
-                                if order.side == 'sell' and order.status == OrderStatus.PENDING)
-        
-        if pending_buy_orders > 0 or pending_sell_orders > 0:
-            print(f"Checking market data: {pending_buy_orders} pending buy orders, {pending_sell_orders} pending sell orders")
-            print(f"Market ask: {asks[0].price if asks else 'None'}, Market bid: {bids[0].price if bids else 'None'}")
+        if logger.isEnabledFor(logging.DEBUG):
+            resting_buy_orders = self._resting_counts[OrderSide.BUY]
+            resting_sell_orders = self._resting_counts[OrderSide.SELL]
+            
+            if resting_buy_orders > 0 or resting_sell_orders > 0:
+                logger.debug("Checking market data: %s resting buy orders, %s resting sell orders",
+                             resting_buy_orders, resting_sell_orders)
+                logger.debug("Market ask: %s, Market bid: %s", self._market_best_ask, self._market_best_bid)
         
         # Check existing limit orders against new market prices
         return self._check_limit_orders_against_market()
@@ -519,185 +441,113 @@ class OrderMatchingEngine:
     def _check_limit_orders_against_market(self):
         """Check existing limit orders against current market data for potential fills"""
         fills = []
-        
-        # Debug logging
-        pending_orders = [order for order in self.orders.values() if order.status == OrderStatus.PENDING]
-        if pending_orders:
-            print(f"DEBUG: Checking {len(pending_orders)} pending orders against market data")
-            for order in pending_orders:
-                print(f"DEBUG: Pending order {order.id}: {order.side} {order.remaining_quantity} at {order.price}")
+        now = time.time_ns()
         
         # Check buy orders against market asks
-        if self.market_asks and len(self.market_asks) > 0:
-            market_ask_price = self.market_asks[0].price
-            print(f"DEBUG: Market ask price: {market_ask_price}")
-            
-            # Create a temporary list to hold all buy orders
-            temp_buy_orders = []
-            buy_orders_to_fill = []
-            
-            # Extract all buy orders from heap
-            while self.buy_orders:
-                order_entry = heapq.heappop(self.buy_orders)
-                temp_buy_orders.append(order_entry)
-            
-            print(f"DEBUG: Processing {len(temp_buy_orders)} buy orders from heap")
-            
-            # Process each order
-            for order_entry in temp_buy_orders:
-                neg_price, timestamp, order_id = order_entry
-                buy_price = -neg_price
-                
-                if order_id in self.orders:
-                    order = self.orders[order_id]
-                    
-                    # Skip if order is not pending anymore
-                    if order.status != OrderStatus.PENDING:
-                        continue
-                        
-                    # Use the actual order price from the order object, not from heap entry
-                    # (in case the order was updated but heap wasn't updated properly)
-                    actual_price = order.price
-                    
-                    print(f"DEBUG: Buy order {order_id}: heap_price {buy_price}, actual_price {actual_price}, market ask {market_ask_price}, status {order.status}")
-                    
-                    # If buy price >= market ask price and order is still pending, it can be filled
-                    if actual_price >= market_ask_price:
-                        print(f"DEBUG: Buy order {order_id} should fill! {actual_price} >= {market_ask_price}")
-                        buy_orders_to_fill.append((order, market_ask_price))
-                    else:
-                        # Keep pending orders that don't match - put them back in heap with correct price
-                        heapq.heappush(self.buy_orders, (
-                            -actual_price,
-                            timestamp, 
-                            order_id
-                        ))
-                else:
-                    print(f"DEBUG: Order {order_id} not found in orders dictionary")
-            
-            # Fill the matching buy orders
-            for order, fill_price in buy_orders_to_fill:
-                print(f"DEBUG: Filling buy order {order.id} at {fill_price}")
-                fill = Fill(
-                    id=str(uuid.uuid4()),
-                    buyer_order_id=order.id,
-                    seller_order_id="MARKET_LIQUIDITY",
-                    buyer_id=order.user_id,
-                    seller_id="MARKET",
-                    symbol=order.symbol,
-                    quantity=order.remaining_quantity,
-                    price=fill_price,
-                    timestamp=datetime.utcnow()
-                )
-                fills.append(fill)
-                
-                # Update order status
-                order.filled_quantity += order.remaining_quantity
-                order.status = OrderStatus.FILLED
-                
-                # Store the fill in engine's internal state
-                self.fills.append(fill)
-                if fill.buyer_id != "MARKET":
-                    self.user_fills[fill.buyer_id].append(fill)
-                if fill.seller_id != "MARKET":
-                    self.user_fills[fill.seller_id].append(fill)
-                
-                # Update last price
-                self.last_price = fill.price
+        market_ask_price = self._market_best_ask
+        if market_ask_price is not None:
+            # Every bid level at or above the market ask crosses, best first
+            for price in list(self.bid_levels.irange(minimum=market_ask_price, reverse=True)):
+                self._fill_level_against_market(OrderSide.BUY, price, market_ask_price, now, fills)
         
         # Check sell orders against market bids
-        if self.market_bids and len(self.market_bids) > 0:
-            market_bid_price = self.market_bids[0].price
-            print(f"DEBUG: Market bid price: {market_bid_price}")
-            
-            # Create a temporary list to hold all sell orders
-            temp_sell_orders = []
-            sell_orders_to_fill = []
-            
-            # Extract all sell orders from heap
-            while self.sell_orders:
-                order_entry = heapq.heappop(self.sell_orders)
-                temp_sell_orders.append(order_entry)
-            
-            print(f"DEBUG: Processing {len(temp_sell_orders)} sell orders from heap")
-            
-            # Process each order
-            for order_entry in temp_sell_orders:
-                price, timestamp, order_id = order_entry
-                
-                if order_id in self.orders:
-                    order = self.orders[order_id]
-                    
-                    # Skip if order is not pending anymore
-                    if order.status != OrderStatus.PENDING:
-                        continue
-                        
-                    # Use the actual order price from the order object, not from heap entry
-                    # (in case the order was updated but heap wasn't updated properly)
-                    actual_price = order.price
-                    
-                    print(f"DEBUG: Sell order {order_id}: heap_price {price}, actual_price {actual_price}, market bid {market_bid_price}, status {order.status}")
-                    
-                    # If sell price <= market bid price and order is still pending, it can be filled
-                    if actual_price <= market_bid_price:
-                        print(f"DEBUG: Sell order {order_id} should fill! {actual_price} <= {market_bid_price}")
-                        sell_orders_to_fill.append((order, market_bid_price))
-                    else:
-                        # Keep pending orders that don't match - put them back in heap with correct price
-                        heapq.heappush(self.sell_orders, (
-                            actual_price,
-                            timestamp,
-                            order_id
-                        ))
-                else:
-                    print(f"DEBUG: Order {order_id} not found in orders dictionary")
-            
-            # Fill the matching sell orders
-            for order, fill_price in sell_orders_to_fill:
-                print(f"DEBUG: Filling sell order {order.id} at {fill_price}")
-                fill = Fill(
-                    id=str(uuid.uuid4()),
-                    buyer_order_id="MARKET_LIQUIDITY",
-                    seller_order_id=order.id,
-                    buyer_id="MARKET",
-                    seller_id=order.user_id,
-                    symbol=order.symbol,
-                    quantity=order.remaining_quantity,
-                    price=fill_price,
-                    timestamp=datetime.utcnow()
-                )
-                fills.append(fill)
-                
-                # Update order status
-                order.filled_quantity += order.remaining_quantity
-                order.status = OrderStatus.FILLED
-                
-                # Store the fill in engine's internal state
-                self.fills.append(fill)
-                if fill.buyer_id != "MARKET":
-                    self.user_fills[fill.buyer_id].append(fill)
-                if fill.seller_id != "MARKET":
-                    self.user_fills[fill.seller_id].append(fill)
-                
-                # Update last price
-                self.last_price = fill.price
+        market_bid_price = self._market_best_bid
+        if market_bid_price is not None:
+            # Every ask level at or below the market bid crosses, best first
+            for price in list(self.ask_levels.irange(maximum=market_bid_price)):
+                self._fill_level_against_market(OrderSide.SELL, price, market_bid_price, now, fills)
         
+        self._store_fills(fills)
         return fills
     
-    def _process_fill(self, fill: Fill):
-        """Process a fill and update internal state"""
-        # Add fill to user's fill history
-        if fill.buyer_id != "MARKET":
-            if fill.buyer_id not in self.user_fills:
-                self.user_fills[fill.buyer_id] = []
-            self.user_fills[fill.buyer_id].append(fill)
+    def _fill_level_against_market(self, side: OrderSide, price: float, fill_price: float, now: int, fills: List[Fill]):
+        """Fill every live order of a price level completely against market liquidity and drop the level"""
+        queue = self._book_side(side).pop(price)
+        del self._book_depth(side)[price]
+        
+        by_id = self._by_id
+        debug = logger.isEnabledFor(logging.DEBUG)
+        filled = 0
+        
+        for order in queue:
+            if order.status not in LIVE_STATUSES:
+                self._tombstones -= 1
+                continue
+            
+            if debug:
+                logger.debug("Filling %s order %s at %s against the market", side.value, order.id, fill_price)
+            del by_id[order.id]
+            order.status = OrderStatus.FILLED
+            fills.append(self._fill_against_market(order, fill_price, now))
+            filled += 1
         
-        if fill.seller_id != "MARKET":
-            if fill.seller_id not in self.user_fills:
-                self.user_fills[fill.seller_id] = []
-            self.user_fills[fill.seller_id].append(fill)
+        self._resting_counts[side] -= filled
+    
+    def _store_fills(self, fills: List[Fill]):
+        """Append fills to the trade history of the engine and the (real) users involved"""
+        if not fills:
+            return
         
-        # Update last price
-        self.last_price = fill.price
+        self.fills.extend(fills)
+        user_fills = self.user_fills
+        for fill in fills:
+            if fill.buyer_id != MARKET_USER_ID:
+                user_fills[fill.buyer_id].append(fill)
+            if fill.seller_id != MARKET_USER_ID:
+                user_fills[fill.seller_id].append(fill)
         
-        logger.info(f"Processed fill: {fill.quantity} at {fill.price} between {fill.buyer_id} and {fill.seller_id}")
+        # Update last price
+        self.last_price = self._last_price_cache = fills[-1].price
+
+
+class AsyncOrderMatchingEngine:
+    """
+    Coroutine interface over an in-memory OrderMatchingEngine, matching
+    RedisOrderMatchingEngine so that callers can use either engine the same way.
+    
+    Each method calls straight into the engine without awaiting first, so calls
+    still run to completion one at a time and the engine stays single-writer.
+    """
+    
+    def __init__(self, engine: Optional[OrderMatchingEngine] = None):
+        self.engine = engine if engine is not None else OrderMatchingEngine()
+    
+    async def process_order(self, order: Order) -> List[Fill]:
+        """Process a new order and return any fills"""
+        return self.engine.process_order(order)
+    
+    async def cancel_order(self, order_id: str, user_id: str) -> bool:
+        """Cancel an order"""
+        return self.engine.cancel_order(order_id, user_id)
+    
+    async def update_order(self, order_id: str, user_id: str, new_price: Optional[float], new_quantity: Optional[float]) -> bool:
+        """Update an order (cancel and replace)"""
+        return self.engine.update_order(order_id, user_id, new_price, new_quantity)
+    
+    async def get_user_orders(self, user_id: str) -> List[Order]:
+        """Get all orders for a user"""
+        return self.engine.get_user_orders(user_id)
+    
+    async def get_user_fills(self, user_id: str) -> List[Fill]:
+        """Get all fills for a user"""
+        return self.engine.get_user_fills(user_id)
+    
+    async def get_order_book(self) -> dict:
+        """Get current order book state"""
+        return self.engine.get_order_book()
+    
+    async def get_best_bid(self) -> Optional[float]:
+        """Get best bid price"""
+        return self.engine.get_best_bid()
+    
+    async def get_best_ask(self) -> Optional[float]:
+        """Get best ask price"""
+        return self.engine.get_best_ask()
+    
+    async def get_last_price(self) -> float:
+        """Get last traded price"""
+        return self.engine.get_last_price()
+    
+    async def update_market_data(self, bids: List[BookLevel], asks: List[BookLevel]) -> List[Fill]:
+        """Update market data from external feed and check for limit order fills"""
+        return self.engine.update_market_data(bids, asks)
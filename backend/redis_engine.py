@@ -0,0 +1,498 @@
+"""
+Redis-backed Order Matching Engine for Home Broker Simulator
+
+Keeps the order book in Redis so that every worker shares it. Each side of
+the book is a sorted set scored by price, order metadata lives in one hash
+per order, and matching runs inside Lua scripts so that it is atomic across
+workers.
+"""
+
+from typing import List, Optional
+import logging
+import time
+
+import orjson
+
+from models import Order, OrderType, OrderSide, OrderStatus, Fill, BookLevel
+from order_matching import DEFAULT_LAST_PRICE, FILL_HISTORY_SIZE, MARKET_ORDER_ID, MARKET_USER_ID, new_fill_id
+
+logger = logging.getLogger(__name__)
+
+# Seconds the cached last price may lag behind fills made by other workers
+LAST_PRICE_CACHE_TTL = 1.0
+
+# Sorted set members are "<20 digit sequence>:<order id>" so that orders at the
+# same price (same score) keep time priority. Bids are scored with the negated
+# price so that the best level of both sides is the first member.
+# Order hashes live at "order:<id>".
+
+LUA_HELPERS = """
+local function fmt(x)
+    return string.format('%.17g', x)
+end
+
+local function member_order_id(member)
+    return string.sub(member, 22)
+end
+
+local function new_member(seq_key, order_id)
+    return string.format('%020d', redis.call('INCR', seq_key)) .. ':' .. order_id
+end
+"""
+
+# KEYS: bids, asks, sequence, last price, market top of book
+# ARGV: id, user_id, symbol, order_type, side, quantity, price ('' for market), timestamp
+# Returns the fills as {counterparty order id, counterparty user id, quantity, price}
+PROCESS_ORDER_SCRIPT = LUA_HELPERS + """
+local order_id, user_id, side = ARGV[1], ARGV[2], ARGV[5]
+local quantity = tonumber(ARGV[6])
+local price = tonumber(ARGV[7])
+local is_buy = side == 'buy'
+local opposite = is_buy and KEYS[2] or KEYS[1]
+local filled = 0
+local fills = {}
+
+-- Match against resting orders on the opposite side
+while filled < quantity do
+    local top = redis.call('ZRANGE', opposite, 0, 0, 'WITHSCORES')
+    if #top == 0 then
+        break
+    end
+
+    local member = top[1]
+    local level_price = tonumber(top[2])
+    if not is_buy then
+        level_price = -level_price
+    end
+
+    if price and ((is_buy and price < level_price) or (not is_buy and price > level_price)) then
+        break
+    end
+
+    local resting_id = member_order_id(member)
+    local resting_key = 'order:' .. resting_id
+    local resting = redis.call('HMGET', resting_key, 'user_id', 'quantity', 'filled_quantity')
+    local resting_quantity = tonumber(resting[2])
+    local resting_filled = tonumber(resting[3])
+
+    local fill_qty = math.min(quantity - filled, resting_quantity - resting_filled)
+    filled = filled + fill_qty
+    resting_filled = resting_filled + fill_qty
+
+    if resting_filled >= resting_quantity then
+        redis.call('HSET', resting_key, 'filled_quantity', fmt(resting_filled), 'status', 'filled', 'member', '')
+        redis.call('ZREM', opposite, member)
+    else
+        redis.call('HSET', resting_key, 'filled_quantity', fmt(resting_filled), 'status', 'partial')
+    end
+
+    table.insert(fills, {resting_id, resting[1], fmt(fill_qty), fmt(level_price)})
+end
+
+-- Match the rest against market liquidity
+if filled < quantity then
+    local market_price = tonumber(redis.call('HGET', KEYS[5], is_buy and 'ask' or 'bid'))
+    if market_price and (not price or (is_buy and price >= market_price) or (not is_buy and price <= market_price)) then
+        local fill_qty = quantity - filled
+        filled = filled + fill_qty
+        table.insert(fills, {'MARKET_LIQUIDITY', 'MARKET', fmt(fill_qty), fmt(market_price)})
+    end
+end
+
+local status = 'pending'
+if filled >= quantity then
+    status = 'filled'
+elseif filled > 0 then
+    status = 'partial'
+end
+
+-- Rest the remainder of limit orders in the book
+local member = ''
+if price and filled < quantity then
+    member = new_member(KEYS[3], order_id)
+    redis.call('ZADD', is_buy and KEYS[1] or KEYS[2], is_buy and -price or price, member)
+end
+
+redis.call('HSET', 'order:' .. order_id,
+    'id', order_id, 'user_id', user_id, 'symbol', ARGV[3], 'order_type', ARGV[4],
+    'side', side, 'quantity', ARGV[6], 'price', ARGV[7], 'timestamp', ARGV[8],
+    'filled_quantity', fmt(filled), 'status', status, 'member', member)
+redis.call('RPUSH', 'user_orders:' .. user_id, order_id)
+
+if #fills > 0 then
+    redis.call('SET', KEYS[4], fills[#fills][4])
+end
+
+return fills
+"""
+
+# KEYS: bids, asks  ARGV: order id, user id
+CANCEL_ORDER_SCRIPT = """
+local key = 'order:' .. ARGV[1]
+local order = redis.call('HMGET', key, 'user_id', 'status', 'side', 'member')
+if order[1] ~= ARGV[2] or order[2] == 'filled' or order[2] == 'cancelled' then
+    return 0
+end
+
+if order[4] ~= '' then
+    redis.call('ZREM', order[3] == 'buy' and KEYS[1] or KEYS[2], order[4])
+end
+redis.call('HSET', key, 'status', 'cancelled', 'member', '')
+return 1
+"""
+
+# KEYS: bids, asks, sequence  ARGV: order id, user id, new price or '', new quantity or ''
+UPDATE_ORDER_SCRIPT = LUA_HELPERS + """
+local key = 'order:' .. ARGV[1]
+local order = redis.call('HMGET', key, 'user_id', 'status', 'side', 'member', 'price')
+if order[1] ~= ARGV[2] or order[2] ~= 'pending' then
+    return 0
+end
+
+local is_buy = order[3] == 'buy'
+local book = is_buy and KEYS[1] or KEYS[2]
+if order[4] ~= '' then
+    redis.call('ZREM', book, order[4])
+end
+
+local price = order[5]
+if ARGV[3] ~= '' then
+    price = ARGV[3]
+    redis.call('HSET', key, 'price', price)
+end
+if ARGV[4] ~= '' then
+    -- Reset filled quantity if quantity is updated
+    redis.call('HSET', key, 'quantity', ARGV[4], 'filled_quantity', '0')
+end
+
+-- Add the updated order back to the end of its (new) price level
+if order[4] ~= '' then
+    local member = new_member(KEYS[3], ARGV[1])
+    price = tonumber(price)
+    redis.call('ZADD', book, is_buy and -price or price, member)
+    redis.call('HSET', key, 'member', member)
+end
+return 1
+"""
+
+# KEYS: bids, asks, last price, market top of book  ARGV: market bid or '', market ask or ''
+# Returns the fills as {order id, user id, side, quantity, price}
+CHECK_MARKET_SCRIPT = LUA_HELPERS + """
+local market_bid = tonumber(ARGV[1])
+local market_ask = tonumber(ARGV[2])
+
+if market_bid then redis.call('HSET', KEYS[4], 'bid', ARGV[1]) else redis.call('HDEL', KEYS[4], 'bid') end
+if market_ask then redis.call('HSET', KEYS[4], 'ask', ARGV[2]) else redis.call('HDEL', KEYS[4], 'ask') end
+
+local fills = {}
+
+-- Fill every resting order that crosses the market, best level first
+local function fill_crossing(book, side, market_price, crosses)
+    while true do
+        local top = redis.call('ZRANGE', book, 0, 0, 'WITHSCORES')
+        if #top == 0 or not crosses(tonumber(top[2])) then
+            break
+        end
+
+        local order_id = member_order_id(top[1])
+        local key = 'order:' .. order_id
+        local order = redis.call('HMGET', key, 'user_id', 'quantity', 'filled_quantity')
+        local fill_qty = tonumber(order[2]) - tonumber(order[3])
+
+        redis.call('HSET', key, 'filled_quantity', fmt(tonumber(order[3]) + fill_qty), 'status', 'filled', 'member', '')
+        redis.call('ZREM', book, top[1])
+        table.insert(fills, {order_id, order[1], side, fmt(fill_qty), fmt(market_price)})
+    end
+end
+
+if market_ask then
+    fill_crossing(KEYS[1], 'buy', market_ask, function(score) return -score >= market_ask end)
+end
+if market_bid then
+    fill_crossing(KEYS[2], 'sell', market_bid, function(score) return score <= market_bid end)
+end
+
+if #fills > 0 then
+    redis.call('SET', KEYS[3], fills[#fills][5])
+end
+
+return fills
+"""
+
+# KEYS: bids, asks  ARGV: depth
+# Returns {bids, asks} as lists of {price, quantity} aggregated per price level
+BOOK_LEVELS_SCRIPT = LUA_HELPERS + """
+local depth = tonumber(ARGV[1])
+
+local function side_levels(book, negate)
+    local levels = {}
+    local last_price = nil
+    local offset = 0
+
+    while true do
+        local entries = redis.call('ZRANGE', book, offset, offset + 99, 'WITHSCORES')
+        if #entries == 0 then
+            break
+        end
+
+        for i = 1, #entries, 2 do
+            local price = tonumber(entries[i + 1])
+            if negate then
+                price = -price
+            end
+
+            if price ~= last_price then
+                if #levels == depth then
+                    return levels
+                end
+                table.insert(levels, {price, 0})
+                last_price = price
+            end
+
+            local order = redis.call('HMGET', 'order:' .. member_order_id(entries[i]), 'quantity', 'filled_quantity')
+            levels[#levels][2] = levels[#levels][2] + (tonumber(order[1]) - tonumber(order[2]))
+        end
+        offset = offset + 100
+    end
+
+    return levels
+end
+
+local result = {}
+for _, levels in ipairs({side_levels(KEYS[1], true), side_levels(KEYS[2], false)}) do
+    local formatted = {}
+    for i, level in ipairs(levels) do
+        formatted[i] = {fmt(level[1]), fmt(level[2])}
+    end
+    table.insert(result, formatted)
+end
+return result
+"""
+
+
+class RedisOrderMatchingEngine:
+    """
+    Order matching engine with price-time priority whose book lives in Redis.
+    Mirrors OrderMatchingEngine, but every method is a coroutine.
+    """
+    
+    def __init__(self, redis, symbol: str = "BTCUSD"):
+        # Expects a redis.asyncio client created with decode_responses=True
+        self.redis = redis
+        self.symbol = symbol
+        
+        self.bids_key = f"book:{symbol}:bids"
+        self.asks_key = f"book:{symbol}:asks"
+        self.seq_key = f"book:{symbol}:seq"
+        self.last_price_key = f"book:{symbol}:last_price"
+        self.market_key = f"book:{symbol}:market"
+        
+        self._process_order = redis.register_script(PROCESS_ORDER_SCRIPT)
+        self._cancel_order = redis.register_script(CANCEL_ORDER_SCRIPT)
+        self._update_order = redis.register_script(UPDATE_ORDER_SCRIPT)
+        self._check_market = redis.register_script(CHECK_MARKET_SCRIPT)
+        self._book_levels = redis.register_script(BOOK_LEVELS_SCRIPT)
+        
+        # Last traded price (None before the first trade) and when it was read
+        self._last_price_cache: Optional[float] = None
+        self._last_price_cached_at: Optional[float] = None
+    
+    async def process_order(self, order: Order) -> List[Fill]:
+        """
+        Process an incoming order and return any fills
+        """
+        matches = await self._process_order(
+            keys=[self.bids_key, self.asks_key, self.seq_key, self.last_price_key, self.market_key],
+            args=[
+                order.id, order.user_id, order.symbol, order.order_type.value, order.side.value,
+                repr(order.quantity), repr(order.price) if order.price is not None else "",
+                order.timestamp,
+            ],
+        )
+        
+        fills = []
+        now = time.time_ns()
+        for counterparty_order_id, counterparty_id, quantity, price in matches:
+            if order.side is OrderSide.BUY:
+                buyer_order_id, seller_order_id = order.id, counterparty_order_id
+                buyer_id, seller_id = order.user_id, counterparty_id
+            else:
+                buyer_order_id, seller_order_id = counterparty_order_id, order.id
+                buyer_id, seller_id = counterparty_id, order.user_id
+            
+            fills.append(self._new_fill(buyer_order_id, seller_order_id, buyer_id, seller_id,
+                                        float(quantity), float(price), now))
+            order.filled_quantity += float(quantity)
+        
+        # Update order status
+        if order.is_fully_filled:
+            order.status = OrderStatus.FILLED
+        elif order.filled_quantity > 0:
+            order.status = OrderStatus.PARTIAL
+        
+        await self._store_fills(fills)
+        if fills:
+            self._cache_last_price(fills[-1].price)
+        logger.info("Processed order %s, generated %d fills", order.id, len(fills))
+        return fills
+    
+    async def cancel_order(self, order_id: str, user_id: str) -> bool:
+        """Cancel an order"""
+        cancelled = await self._cancel_order(keys=[self.bids_key, self.asks_key], args=[order_id, user_id])
+        if cancelled:
+            logger.info("Cancelled order %s", order_id)
+        return bool(cancelled)
+    
+    async def update_order(self, order_id: str, user_id: str, new_price: Optional[float], new_quantity: Optional[float]) -> bool:
+        """Update an order (cancel and replace)"""
+        updated = await self._update_order(
+            keys=[self.bids_key, self.asks_key, self.seq_key],
+            args=[
+                order_id, user_id,
+                repr(float(new_price)) if new_price is not None else "",
+                repr(float(new_quantity)) if new_quantity is not None else "",
+            ],
+        )
+        if updated:
+            logger.info("Updated order %s", order_id)
+        return bool(updated)
+    
+    async def get_user_orders(self, user_id: str) -> List[Order]:
+        """Get all orders for a user"""
+        order_ids = await self.redis.lrange(f"user_orders:{user_id}", 0, -1)
+        
+        pipe = self.redis.pipeline(transaction=False)
+        for order_id in order_ids:
+            pipe.hgetall(f"order:{order_id}")
+        
+        return [self._order_from_hash(data) for data in await pipe.execute() if data]
+    
+    async def get_user_fills(self, user_id: str) -> List[Fill]:
+        """Get all fills for a user"""
+        entries = await self.redis.lrange(f"user_fills:{user_id}", 0, -1)
+        
+        fills = []
+        for entry in entries:
+            fills.append(Fill(**orjson.loads(entry)))
+        return fills
+    
+    async def get_order_book(self) -> dict:
+        """Get current order book state"""
+        bids, asks = await self._book_levels(keys=[self.bids_key, self.asks_key], args=[10])
+        last_price = await self.redis.get(self.last_price_key)
+        last_price = float(last_price) if last_price is not None else None
+        self._cache_last_price(last_price)
+        
+        return {
+            "symbol": self.symbol,
+            "bids": [(float(price), float(qty)) for price, qty in bids],
+            "asks": [(float(price), float(qty)) for price, qty in asks],
+            "last_price": last_price,
+            "timestamp": time.time_ns()
+        }
+    
+    async def get_best_bid(self) -> Optional[float]:
+        """Get best bid price"""
+        top = await self.redis.zrange(self.bids_key, 0, 0, withscores=True)
+        return -top[0][1] if top else None
+    
+    async def get_best_ask(self) -> Optional[float]:
+        """Get best ask price"""
+        top = await self.redis.zrange(self.asks_key, 0, 0, withscores=True)
+        return top[0][1] if top else None
+    
+    async def get_last_price(self) -> float:
+        """Get last traded price"""
+        if (self._last_price_cached_at is None
+                or time.monotonic() - self._last_price_cached_at >= LAST_PRICE_CACHE_TTL):
+            last_price = await self.redis.get(self.last_price_key)
+            self._cache_last_price(float(last_price) if last_price is not None else None)
+        
+        return self._last_price_cache if self._last_price_cache is not None else DEFAULT_LAST_PRICE
+    
+    async def update_market_data(self, bids: List[BookLevel], asks: List[BookLevel]) -> List[Fill]:
+        """Update market data from external feed and check for limit order fills"""
+        matches = await self._check_market(
+            keys=[self.bids_key, self.asks_key, self.last_price_key, self.market_key],
+            args=[
+                repr(float(bids[0].price)) if bids else "",
+                repr(float(asks[0].price)) if asks else "",
+            ],
+        )
+        
+        fills = []
+        now = time.time_ns()
+        for order_id, user_id, side, quantity, price in matches:
+            if side == OrderSide.BUY.value:
+                fills.append(self._new_fill(order_id, MARKET_ORDER_ID, user_id, MARKET_USER_ID,
+                                            float(quantity), float(price), now))
+            else:
+                fills.append(self._new_fill(MARKET_ORDER_ID, order_id, MARKET_USER_ID, user_id,
+                                            float(quantity), float(price), now))
+        
+        await self._store_fills(fills)
+        if fills:
+            self._cache_last_price(fills[-1].price)
+        return fills
+    
+    def _cache_last_price(self, last_price: Optional[float]):
+        self._last_price_cache = last_price
+        self._last_price_cached_at = time.monotonic()
+    
+    def _new_fill(self, buyer_order_id: str, seller_order_id: str, buyer_id: str, seller_id: str,
+                  quantity: float, price: float, timestamp: int) -> Fill:
+        return Fill(
+            id=new_fill_id(),
+            buyer_order_id=buyer_order_id,
+            seller_order_id=seller_order_id,
+            buyer_id=buyer_id,
+            seller_id=seller_id,
+            symbol=self.symbol,
+            quantity=quantity,
+            price=price,
+            timestamp=timestamp
+        )
+    
+    async def _store_fills(self, fills: List[Fill]):
+        """Append fills to the trade history of the (real) users involved"""
+        if not fills:
+            return
+        
+        pipe = self.redis.pipeline(transaction=False)
+        users = set()
+        for fill in fills:
+            entry = orjson.dumps({
+                "id": fill.id,
+                "buyer_order_id": fill.buyer_order_id,
+                "seller_order_id": fill.seller_order_id,
+                "buyer_id": fill.buyer_id,
+                "seller_id": fill.seller_id,
+                "symbol": fill.symbol,
+                "quantity": fill.quantity,
+                "price": fill.price,
+                "timestamp": fill.timestamp,
+            })
+            for user_id in (fill.buyer_id, fill.seller_id):
+                if user_id != MARKET_USER_ID:
+                    pipe.rpush(f"user_fills:{user_id}", entry)
+                    users.add(user_id)
+        
+        # Keep only the most recent fills, like the in-memory trade history
+        for user_id in users:
+            pipe.ltrim(f"user_fills:{user_id}", -FILL_HISTORY_SIZE, -1)
+        await pipe.execute()
+    
+    @staticmethod
+    def _order_from_hash(data: dict) -> Order:
+        return Order(
+            id=data["id"],
+            user_id=data["user_id"],
+            symbol=data["symbol"],
+            order_type=OrderType(data["order_type"]),
+            side=OrderSide(data["side"]),
+            quantity=float(data["quantity"]),
+            price=float(data["price"]) if data["price"] else None,
+            timestamp=int(data["timestamp"]),
+            filled_quantity=float(data["filled_quantity"]),
+            status=OrderStatus(data["status"]),
+        )
@@ -0,0 +1,124 @@
+"""
+User Balance Storage for Home Broker Simulator
+"""
+
+from typing import Dict, Optional
+import logging
+
+from models import User
+
+logger = logging.getLogger(__name__)
+
+# Atomically settle a fill between two user hashes. Users without a hash
+# (e.g. the synthetic MARKET counterparty) are skipped.
+# KEYS: buyer hash, seller hash  ARGV: quantity, price
+APPLY_FILL_SCRIPT = """
+local quantity = tonumber(ARGV[1])
+local notional = quantity * tonumber(ARGV[2])
+local result = {}
+
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'cash_balance', -notional)
+    redis.call('HINCRBYFLOAT', KEYS[1], 'asset_balance', quantity)
+    result[1] = redis.call('HMGET', KEYS[1], 'cash_balance', 'asset_balance')
+else
+    result[1] = false
+end
+
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[2], 'cash_balance', notional)
+    redis.call('HINCRBYFLOAT', KEYS[2], 'asset_balance', -quantity)
+    result[2] = redis.call('HMGET', KEYS[2], 'cash_balance', 'asset_balance')
+else
+    result[2] = false
+end
+
+return result
+"""
+
+
+class UserStore:
+    """In-memory user storage, only visible to the current process"""
+    
+    def __init__(self):
+        self.users: Dict[str, User] = {}
+    
+    async def get(self, user_id: str) -> Optional[User]:
+        """Get a user by ID, or None if it does not exist"""
+        return self.users.get(user_id)
+    
+    async def create(self, user_id: str, cash_balance: float, asset_balance: float) -> User:
+        """Create a user with the given starting balances"""
+        user = User(id=user_id, cash_balance=cash_balance, asset_balance=asset_balance)
+        self.users[user_id] = user
+        return user
+    
+    async def apply_fill(self, buyer_id: str, seller_id: str, quantity: float, price: float) -> Dict[str, User]:
+        """Settle a fill and return the updated users involved in it"""
+        updated = {}
+        
+        buyer = self.users.get(buyer_id)
+        if buyer is not None:
+            buyer.cash_balance -= quantity * price
+            buyer.asset_balance += quantity
+            updated[buyer_id] = buyer
+        
+        seller = self.users.get(seller_id)
+        if seller is not None:
+            seller.cash_balance += quantity * price
+            seller.asset_balance -= quantity
+            updated[seller_id] = seller
+        
+        return updated
+
+
+class RedisUserStore(UserStore):
+    """Redis-backed user storage shared by every worker (one hash per user)"""
+    
+    def __init__(self, redis):
+        super().__init__()
+        # Expects a redis.asyncio client created with decode_responses=True
+        self.redis = redis
+        self._apply_fill = redis.register_script(APPLY_FILL_SCRIPT)
+    
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"user:{user_id}"
+    
+    async def get(self, user_id: str) -> Optional[User]:
+        """Get a user by ID, or None if it does not exist"""
+        data = await self.redis.hgetall(self._key(user_id))
+        if not data:
+            return None
+        
+        return User(
+            id=user_id,
+            cash_balance=float(data["cash_balance"]),
+            asset_balance=float(data["asset_balance"]),
+        )
+    
+    async def create(self, user_id: str, cash_balance: float, asset_balance: float) -> User:
+        """Create a user with the given starting balances"""
+        await self.redis.hset(self._key(user_id), mapping={
+            "cash_balance": cash_balance,
+            "asset_balance": asset_balance,
+        })
+        return User(id=user_id, cash_balance=cash_balance, asset_balance=asset_balance)
+    
+    async def apply_fill(self, buyer_id: str, seller_id: str, quantity: float, price: float) -> Dict[str, User]:
+        """Settle a fill atomically and return the updated users involved in it"""
+        buyer, seller = await self._apply_fill(
+            keys=[self._key(buyer_id), self._key(seller_id)],
+            args=[quantity, price],
+        )
+        
+        updated = {}
+        for user_id, balances in ((buyer_id, buyer), (seller_id, seller)):
+            if balances:
+                updated[user_id] = User(
+                    id=user_id,
+                    cash_balance=float(balances[0]),
+                    asset_balance=float(balances[1]),
+                )
+        
+        return updated
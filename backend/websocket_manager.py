@@ -3,74 +3,375 @@ WebSocket Connection Manager for Home Broker Simulator
 """
 
 from fastapi import WebSocket
-from typing import Dict, List
-import json
+from fastapi.websockets import WebSocketState
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+import asyncio
 import logging
+import sys
+import time
+
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Seconds between full order book snapshots sent to resync delta consumers
+ORDER_BOOK_SNAPSHOT_INTERVAL = 30.0
+# Minimum seconds between order book broadcasts; bursts in between are coalesced
+ORDER_BOOK_FLUSH_INTERVAL = 0.05
+
+# Seconds a single send may take before it is abandoned for that client
+SEND_TIMEOUT = 0.5
+# Consecutive dropped market data frames after which a slow client is disconnected
+MAX_SEND_TIMEOUTS = 3
+
+# Redis pub/sub channels used to fan out messages across workers
+BROADCAST_CHANNEL = "bcast"
+BINARY_BROADCAST_CHANNEL = "bcast:bin"
+USER_CHANNEL_PREFIX = "user:"
+
+
+def _encode(message: dict) -> str:
+    """Encode a message once so it can be sent to every connection"""
+    return orjson.dumps(message).decode()
+
+
+def _diff_levels(old_levels: list, new_levels: list) -> dict:
+    """Diff two lists of (price, quantity) levels"""
+    old = dict(old_levels)
+    new = dict(new_levels)
+    
+    adds = [(price, qty) for price, qty in new.items() if price not in old]
+    changes = [(price, qty) for price, qty in new.items() if price in old and old[price] != qty]
+    removes = [price for price in old if price not in new]
+    
+    return {"adds": adds, "changes": changes, "removes": removes}
+
+
+@dataclass(slots=True)
+class ConnectionRecord:
+    """Per-connection state, kept in a single slotted record per WebSocket"""
+    user_id: str
+    connected_at: float
+    # Resolved once the connection is disconnected
+    closed: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    # Number of consecutive sends that timed out
+    send_timeouts: int = 0
+    # Serializes sends, so concurrent broadcasts and user messages never interleave on the socket
+    send_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
 
 class ConnectionManager:
     """Manages WebSocket connections for real-time updates"""
     
-    def __init__(self):
-        # User ID -> List of WebSocket connections
-        self.user_connections: Dict[str, List[WebSocket]] = {}
-        # WebSocket -> User ID mapping
-        self.connection_users: Dict[WebSocket, str] = {}
+    def __init__(self, snapshot_interval: float = ORDER_BOOK_SNAPSHOT_INTERVAL, redis=None):
+        # User ID -> Set of WebSocket connections
+        self.user_connections: Dict[str, Set[WebSocket]] = {}
+        # WebSocket -> Connection state (user ID, close future, send timeouts)
+        self.connections: Dict[WebSocket, ConnectionRecord] = {}
+        # Snapshot of every connection for broadcasts, rebuilt after connects/disconnects
+        self._broadcast_targets: Optional[Tuple[WebSocket, ...]] = None
+        
+        # Last order book broadcast, used as the base for deltas
+        self._last_book: Optional[dict] = None
+        self._last_snapshot_at: float = 0.0
+        self.snapshot_interval = snapshot_interval
+        
+        # Set whenever the order book changed and still needs to be broadcast
+        self._dirty = asyncio.Event()
+        self._flusher_task: Optional[asyncio.Task] = None
+        
+        # Optional Redis client; when set, messages are published so that
+        # every worker forwards them to its own local connections. It must not
+        # decode responses, since binary broadcasts go through it as well.
+        self.redis = redis
+        self._pubsub = redis.pubsub() if redis is not None else None
+        self._pubsub_task: Optional[asyncio.Task] = None
+        # Pending unsubscribes, referenced so they are not garbage collected mid-flight
+        self._unsubscribe_tasks: Set[asyncio.Task] = set()
     
-    async def connect(self, websocket: WebSocket, user_id: str):
-        """Connect a new WebSocket for a user"""
+    async def connect(self, websocket: WebSocket, user_id: str) -> str:
+        """Connect a new WebSocket for a user and return the (interned) user ID it is registered under"""
         await websocket.accept()
         
-        if user_id not in self.user_connections:
-            self.user_connections[user_id] = []
+        # Interned so that the per-message lookups by user ID hit the identity fast path
+        user_id = sys.intern(user_id)
         
-        self.user_connections[user_id].append(websocket)
-        self.connection_users[websocket] = user_id
+        first_connection = user_id not in self.user_connections
+        if first_connection:
+            self.user_connections[user_id] = set()
         
-        logger.info(f"WebSocket connected for user {user_id}")
+        self.user_connections[user_id].add(websocket)
+        self.connections[websocket] = ConnectionRecord(user_id=user_id, connected_at=time.monotonic())
+        self._broadcast_targets = None
+        
+        # Receive this user's messages published by any worker
+        if first_connection and self._pubsub is not None:
+            await self._pubsub.subscribe(USER_CHANNEL_PREFIX + user_id)
+        
+        logger.info("WebSocket connected for user %s", user_id)
+        return user_id
     
     def disconnect(self, websocket: WebSocket, user_id: str):
-        """Disconnect a WebSocket"""
-        if user_id in self.user_connections:
-            if websocket in self.user_connections[user_id]:
-                self.user_connections[user_id].remove(websocket)
+        """Disconnect a WebSocket; disconnecting it again is a no-op"""
+        record = self.connections.pop(websocket, None)
+        if record is None:
+            return
+        record.closed.set_result(None)
+        self._broadcast_targets = None
+        
+        connections = self.user_connections.get(user_id)
+        if connections is not None:
+            connections.discard(websocket)
             
-            # Clean up empty user connection lists
-            if not self.user_connections[user_id]:
+            # Clean up empty user connection sets
+            if not connections:
                 del self.user_connections[user_id]
+                if self._pubsub is not None:
+                    task = asyncio.create_task(self._unsubscribe_user(user_id))
+                    self._unsubscribe_tasks.add(task)
+                    task.add_done_callback(self._unsubscribe_tasks.discard)
         
-        if websocket in self.connection_users:
-            del self.connection_users[websocket]
+        logger.info("WebSocket disconnected for user %s after %.1fs", user_id, time.monotonic() - record.connected_at)
+    
+    async def _unsubscribe_user(self, user_id: str):
+        """Stop receiving a user's messages, unless they reconnected in the meantime"""
+        if user_id in self.user_connections:
+            return
+        try:
+            await self._pubsub.unsubscribe(USER_CHANNEL_PREFIX + user_id)
+        except Exception as e:
+            logger.error("Error unsubscribing user %s: %s", user_id, e)
+    
+    async def wait_closed(self, websocket: WebSocket):
+        """Wait until the client closes a connected WebSocket or it is disconnected here"""
+        record = self.connections.get(websocket)
+        if record is None:
+            return
+        
+        # Clients never send anything, but receiving is the only way to learn
+        # that they went away, so keep draining it until they do
+        while True:
+            receive = asyncio.ensure_future(websocket.receive())
+            await asyncio.wait((receive, record.closed), return_when=asyncio.FIRST_COMPLETED)
+            if not receive.done():
+                receive.cancel()
+                return
+            if receive.result()["type"] == "websocket.disconnect":
+                return
+    
+    async def close(self, websocket: WebSocket):
+        """Close a WebSocket that is no longer managed, without waiting on a stalled client"""
+        if (websocket.client_state is not WebSocketState.CONNECTED
+                or websocket.application_state is not WebSocketState.CONNECTED):
+            return
+        try:
+            await asyncio.wait_for(websocket.close(), SEND_TIMEOUT)
+        except Exception as e:
+            logger.debug("Error closing WebSocket: %r", e)
+    
+    async def send(self, websocket: WebSocket, message: dict):
+        """Send message to a single connection"""
+        payload = _encode(message)
+        record = self.connections.get(websocket)
+        if record is None:
+            await websocket.send_text(payload)
+            return
         
-        logger.info(f"WebSocket disconnected for user {user_id}")
+        async with record.send_lock:
+            await websocket.send_text(payload)
     
     async def send_to_user(self, user_id: str, message: dict):
         """Send message to all connections of a specific user"""
-        if user_id not in self.user_connections:
+        payload = _encode(message)
+        if self.redis is not None:
+            await self.redis.publish(USER_CHANNEL_PREFIX + user_id, payload)
             return
         
-        connections = self.user_connections[user_id].copy()
-        for websocket in connections:
-            try:
-                await websocket.send_json(message)
-            except Exception as e:
-                logger.error(f"Error sending to user {user_id}: {e}")
-                # Remove broken connection
-                self.disconnect(websocket, user_id)
+        await self._send_local(user_id, payload)
     
     async def broadcast(self, message: dict):
         """Broadcast message to all connected users"""
-        for user_id in list(self.user_connections.keys()):
-            await self.send_to_user(user_id, message)
+        payload = _encode(message)
+        if self.redis is not None:
+            await self.redis.publish(BROADCAST_CHANNEL, payload)
+            return
+        
+        await self._send_payload(self._all_targets(), payload)
+    
+    async def broadcast_bytes(self, payload: bytes):
+        """Broadcast an already encoded binary frame to all connected users"""
+        if self.redis is not None:
+            await self.redis.publish(BINARY_BROADCAST_CHANNEL, payload)
+            return
+        
+        await self._send_payload(self._all_targets(), payload)
+    
+    def _all_targets(self) -> Tuple[WebSocket, ...]:
+        """Every connection of this worker, as a snapshot reused until membership changes"""
+        if self._broadcast_targets is None:
+            self._broadcast_targets = tuple(self.connections)
+        return self._broadcast_targets
+    
+    async def _send_local(self, user_id: str, payload: Union[str, bytes]):
+        """Send an encoded payload to this worker's connections of a user"""
+        connections = self.user_connections.get(user_id)
+        if not connections:
+            return
+        
+        await self._send_payload(tuple(connections), payload)
+    
+    async def _send_payload(self, websockets: Sequence[WebSocket], payload: Union[str, bytes]):
+        """Send an already encoded payload (text or binary frame) to several connections concurrently"""
+        results = await asyncio.gather(
+            *(self._safe_send(websocket, payload) for websocket in websockets),
+            return_exceptions=True
+        )
+        
+        for websocket, result in zip(websockets, results):
+            if isinstance(result, Exception):
+                record = self.connections.get(websocket)
+                user_id = record.user_id if record is not None else None
+                logger.error("Error sending to user %s: %s", user_id, result)
+                # Remove broken connection
+                self.disconnect(websocket, user_id)
+    
+    async def _safe_send(self, websocket: WebSocket, payload: Union[str, bytes]):
+        """
+        Send a payload, dropping it if it is a market data frame the client is too
+        slow to take in time. Raises when any other message times out, or once a
+        client keeps timing out, so that it gets disconnected.
+        """
+        record = self.connections.get(websocket)
+        if record is None:
+            # Disconnected since the targets were chosen
+            return
+        
+        send = websocket.send_bytes if isinstance(payload, bytes) else websocket.send_text
+        try:
+            # Waiting for an earlier send to this socket counts towards the timeout
+            await asyncio.wait_for(self._send_locked(record, send, payload), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            if not isinstance(payload, bytes):
+                # Only binary market data ticks are superseded by the next one; a lost
+                # book delta, fill or account update would leave the client out of sync
+                # until it reconnects and gets a fresh snapshot
+                raise TimeoutError("send timed out")
+            record.send_timeouts += 1
+            if record.send_timeouts > MAX_SEND_TIMEOUTS:
+                raise TimeoutError(f"{record.send_timeouts} consecutive sends timed out")
+            return
+        
+        record.send_timeouts = 0
+    
+    @staticmethod
+    async def _send_locked(record: ConnectionRecord, send: Callable[[Union[str, bytes]], Awaitable[None]],
+                           payload: Union[str, bytes]):
+        """Send a payload while holding the connection's send lock"""
+        async with record.send_lock:
+            await send(payload)
     
     async def broadcast_order_book(self, order_book: dict):
-        """Broadcast order book update to all users"""
+        """Broadcast full order book snapshot to all users"""
+        self._last_book = order_book
+        self._last_snapshot_at = time.monotonic()
+        
         await self.broadcast({
-            "type": "order_book_update",
+            "type": "order_book_snapshot",
+            "data": order_book
+        })
+    
+    async def send_order_book_snapshot(self, websocket: WebSocket, get_order_book: Callable[[], Awaitable[dict]]):
+        """Send a new connection the book that the following deltas are diffed against"""
+        # The engine's current book may already differ from that base, and a change
+        # that is reverted before the next flush would then never reach this client
+        order_book = self._last_book
+        if order_book is None:
+            order_book = await get_order_book()
+        
+        await self.send(websocket, {
+            "type": "order_book_snapshot",
             "data": order_book
         })
+        # Catch the client up with anything that changed since the last broadcast
+        self.mark_book_dirty()
+    
+    async def broadcast_order_book_delta(self, order_book: dict):
+        """Broadcast only the order book levels changed since the last broadcast"""
+        if (self._last_book is None
+                or time.monotonic() - self._last_snapshot_at >= self.snapshot_interval):
+            await self.broadcast_order_book(order_book)
+            return
+        
+        bids = _diff_levels(self._last_book["bids"], order_book["bids"])
+        asks = _diff_levels(self._last_book["asks"], order_book["asks"])
+        last_price_changed = order_book["last_price"] != self._last_book["last_price"]
+        self._last_book = order_book
+        
+        if not (any(bids.values()) or any(asks.values()) or last_price_changed):
+            return
+        
+        await self.broadcast({
+            "type": "order_book_delta",
+            "data": {
+                "bids": bids,
+                "asks": asks,
+                "last_price": order_book["last_price"],
+                "timestamp": order_book["timestamp"]
+            }
+        })
+    
+    async def start_pubsub(self):
+        """Subscribe to the broadcast channel and start forwarding messages"""
+        if self._pubsub is None or self._pubsub_task is not None:
+            return
+        
+        await self._pubsub.subscribe(BROADCAST_CHANNEL, BINARY_BROADCAST_CHANNEL)
+        self._pubsub_task = asyncio.create_task(self._pubsub_reader())
+    
+    async def _pubsub_reader(self):
+        """Forward messages published by any worker to local connections"""
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    
+                    channel = message["channel"].decode()
+                    if channel == BINARY_BROADCAST_CHANNEL:
+                        await self._send_payload(self._all_targets(), message["data"])
+                    elif channel == BROADCAST_CHANNEL:
+                        await self._send_payload(self._all_targets(), message["data"].decode())
+                    elif channel.startswith(USER_CHANNEL_PREFIX):
+                        await self._send_local(channel[len(USER_CHANNEL_PREFIX):], message["data"].decode())
+            except Exception as e:
+                logger.error("Error reading pub/sub messages: %s", e)
+                await asyncio.sleep(1)
+    
+    def mark_book_dirty(self):
+        """Schedule an order book broadcast on the next flush"""
+        self._dirty.set()
+    
+    def start_book_flusher(self, get_order_book: Callable[[], Awaitable[dict]],
+                           min_interval: float = ORDER_BOOK_FLUSH_INTERVAL):
+        """Start the background task that broadcasts order book changes"""
+        if self._flusher_task is None or self._flusher_task.done():
+            self._flusher_task = asyncio.create_task(
+                self._flush_order_book(get_order_book, min_interval)
+            )
+    
+    async def _flush_order_book(self, get_order_book: Callable[[], Awaitable[dict]], min_interval: float):
+        """Broadcast at most one order book delta per interval"""
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            
+            try:
+                await self.broadcast_order_book_delta(await get_order_book())
+            except Exception as e:
+                logger.error("Error flushing order book: %s", e)
+            
+            await asyncio.sleep(min_interval)
     
     def get_connected_users(self) -> List[str]:
         """Get list of connected user IDs"""
@@ -78,4 +379,4 @@ class ConnectionManager:
     
     def get_connection_count(self) -> int:
         """Get total number of active connections"""
-        return sum(len(connections) for connections in self.user_connections.values())
+        return len(self.connections)
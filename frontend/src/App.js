@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import axios from 'axios';
+import { decode } from '@msgpack/msgpack';
 import './App.css';
 import OrderForm from './components/OrderForm';
 import OpenOrders from './components/OpenOrders';
@@ -9,6 +10,24 @@ import MarketData from './components/MarketData';
 
 const API_BASE = process.env.REACT_APP_API_URL || 'http://54.81.44.189:8001';
 const WS_URL = process.env.REACT_APP_WS_URL || 'ws://54.81.44.189:8001/ws';
+const BOOK_DEPTH = 10;
+
+// Apply an order book side delta ({adds, changes, removes}) to a list of [price, quantity] levels
+const applyLevelsDelta = (levels, delta, descending) => {
+  const book = new Map(levels);
+  delta.removes.forEach((price) => book.delete(price));
+  delta.adds.forEach(([price, quantity]) => book.set(price, quantity));
+  delta.changes.forEach(([price, quantity]) => book.set(price, quantity));
+  return Array.from(book.entries())
+    .sort((a, b) => (descending ? b[0] - a[0] : a[0] - b[0]))
+    .slice(0, BOOK_DEPTH);
+};
+
+// Market data arrives as binary msgpack frames with short keys
+const decodeMarketData = (buffer) => {
+  const { s, p, b, a, t } = decode(new Uint8Array(buffer));
+  return { symbol: s, price: p, bids: b, asks: a, timestamp: t };
+};
 
 function App() {
   // State management
@@ -24,6 +43,7 @@ function App() {
   const connectWebSocket = useCallback(() => {
     try {
       const websocket = new WebSocket(WS_URL);
+      websocket.binaryType = 'arraybuffer';
       
       websocket.onopen = () => {
         console.log('WebSocket connected');
@@ -32,6 +52,11 @@ function App() {
       };
       
       websocket.onmessage = (event) => {
+        if (event.data instanceof ArrayBuffer) {
+          setMarketData(decodeMarketData(event.data));
+          return;
+        }
+        
         const message = JSON.parse(event.data);
         console.log('WebSocket message:', message);
         
@@ -39,30 +64,33 @@ function App() {
           case 'user_info':
             setUserInfo(message.data);
             break;
-          case 'order_book':
-          case 'order_book_update':
+          case 'order_book_snapshot':
             setOrderBook(message.data);
             break;
+          case 'order_book_delta':
+            // Apply incremental level changes on top of the last snapshot
+            setOrderBook(prev => ({
+              ...prev,
+              bids: applyLevelsDelta(prev.bids, message.data.bids, true),
+              asks: applyLevelsDelta(prev.asks, message.data.asks, false),
+              last_price: message.data.last_price,
+              timestamp: message.data.timestamp
+            }));
+            break;
           case 'fill':
             // Refresh user info and trade history on fill
             fetchUserInfo();
             fetchTradeHistory();
             fetchOpenOrders();
             break;
-          case 'balance_update':
-            // Update user balance directly
+          case 'account_update':
+            // Update user balance and orders directly
             setUserInfo(prev => ({
               ...prev,
               cash_balance: message.data.cash_balance,
               asset_balance: message.data.asset_balance
             }));
-            break;
-          case 'orders_update':
-            // Update orders directly
-            setOpenOrders(message.data);
-            break;
-          case 'market_data':
-            setMarketData(message.data);
+            setOpenOrders(message.data.orders);
             break;
           default:
             console.log('Unknown message type:', message.type);
@@ -62,7 +62,7 @@ const MarketData = ({ marketData }) => {
         </div>
         {timestamp && (
           <div style={{ fontSize: '0.8rem', color: '#64748b', marginTop: '0.5rem' }}>
-            Updated: {new Date(timestamp).toLocaleTimeString()}
+            Updated: {new Date(timestamp / 1e6).toLocaleTimeString()}
           </div>
         )}
       </div>
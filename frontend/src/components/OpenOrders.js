@@ -49,8 +49,9 @@ const OpenOrders = ({ orders, onCancelOrder, onUpdateOrder }) => {
     return quantity ? quantity.toFixed(8) : '0';
   };
 
+  // Timestamps are nanoseconds since the epoch
   const formatTime = (timestamp) => {
-    return new Date(timestamp).toLocaleTimeString();
+    return new Date(timestamp / 1e6).toLocaleTimeString();
   };
 
   const getStatusColor = (status) => {
@@ -65,7 +66,7 @@ const OpenOrders = ({ orders, onCancelOrder, onUpdateOrder }) => {
 
   // Sort orders by timestamp in descending order (newest first)
   const sortedOrders = [...orders].sort((a, b) => {
-    return new Date(b.timestamp) - new Date(a.timestamp);
+    return b.timestamp - a.timestamp;
   });
 
   return (
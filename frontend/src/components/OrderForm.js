@@ -93,7 +93,9 @@ const OrderForm = ({ onPlaceOrder, currentPrice, orderBook }) => {
 
     } catch (err) {
       console.error('Order submission error:', err);
-      setError(err.response?.data?.detail || err.message || 'Failed to place order');
+      const detail = err.response?.data?.detail;
+      // Validation errors come back as a list of { msg, ... } objects
+      setError((Array.isArray(detail) ? detail.map(d => d.msg).join(', ') : detail) || err.message || 'Failed to place order');
     } finally {
       setIsSubmitting(false);
     }
@@ -14,13 +14,14 @@ const TradeHistory = ({ trades }) => {
     return quantity.toFixed(8);
   };
 
+  // Timestamps are nanoseconds since the epoch
   const formatTime = (timestamp) => {
-    const date = new Date(timestamp);
+    const date = new Date(timestamp / 1e6);
     return date.toLocaleTimeString();
   };
 
   const formatDate = (timestamp) => {
-    const date = new Date(timestamp);
+    const date = new Date(timestamp / 1e6);
     return date.toLocaleDateString();
   };
 
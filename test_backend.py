@@ -3,42 +3,66 @@ Simple test script to verify the Home Broker Simulator backend
 """
 
 import asyncio
-import json
+import msgpack
 import websockets
 import aiohttp
+import orjson
+import sys
 import time
 
+# Result lines collected during the run and written out once at the end
+results = []
+
+def report(line: str):
+    """Record a result line without writing to stdout mid-test"""
+    results.append(line)
+
 async def test_api_endpoints():
     """Test REST API endpoints"""
-    print("🧪 Testing API endpoints...")
+    report("🧪 Testing API endpoints...")
     
-    async with aiohttp.ClientSession() as session:
+    # One pooled keep-alive connection set for every request of the run
+    connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=30, enable_cleanup_closed=True)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        json_serialize=lambda obj: orjson.dumps(obj).decode()
+    ) as session:
+        async def get_json(path):
+            async with session.get(f'http://localhost:8000{path}') as response:
+                return await response.json(loads=orjson.loads)
+        
+        # Health, user and order book checks are independent, run them concurrently
+        health, user, book = await asyncio.gather(
+            get_json('/'), get_json('/api/user'), get_json('/api/orderbook'),
+            return_exceptions=True
+        )
+        
         # Test health endpoint
         try:
-            async with session.get('http://localhost:8000/') as response:
-                data = await response.json()
-                print(f"✅ Health check: {data['message']}")
+            if isinstance(health, Exception):
+                raise health
+            report(f"✅ Health check: {health['message']}")
         except Exception as e:
-            print(f"❌ Health check failed: {e}")
+            report(f"❌ Health check failed: {e}")
             return False
         
         # Test user endpoint
         try:
-            async with session.get('http://localhost:8000/api/user') as response:
-                data = await response.json()
-                print(f"✅ User info: Cash={data['cash_balance']}, BTC={data['asset_balance']}")
-                user_id = data['user_id']
+            if isinstance(user, Exception):
+                raise user
+            report(f"✅ User info: Cash={user['cash_balance']}, BTC={user['asset_balance']}")
+            user_id = user['user_id']
         except Exception as e:
-            print(f"❌ User endpoint failed: {e}")
+            report(f"❌ User endpoint failed: {e}")
             return False
         
         # Test order book endpoint
         try:
-            async with session.get('http://localhost:8000/api/orderbook') as response:
-                data = await response.json()
-                print(f"✅ Order book: {len(data.get('bids', []))} bids, {len(data.get('asks', []))} asks")
+            if isinstance(book, Exception):
+                raise book
+            report(f"✅ Order book: {len(book.get('bids', []))} bids, {len(book.get('asks', []))} asks")
         except Exception as e:
-            print(f"❌ Order book endpoint failed: {e}")
+            report(f"❌ Order book endpoint failed: {e}")
             return False
         
         # Test placing an order
@@ -51,54 +75,60 @@ async def test_api_endpoints():
             }
             async with session.post('http://localhost:8000/api/orders', 
                                   json=order_data) as response:
-                data = await response.json()
-                print(f"✅ Order placed: {data['order_id']}")
+                data = await response.json(loads=orjson.loads)
+                report(f"✅ Order placed: {data['order_id']}")
                 order_id = data['order_id']
         except Exception as e:
-            print(f"❌ Order placement failed: {e}")
+            report(f"❌ Order placement failed: {e}")
             return False
         
         # Test getting open orders
         try:
             async with session.get('http://localhost:8000/api/orders') as response:
-                data = await response.json()
-                print(f"✅ Open orders: {len(data['orders'])} orders")
+                data = await response.json(loads=orjson.loads)
+                report(f"✅ Open orders: {len(data['orders'])} orders")
         except Exception as e:
-            print(f"❌ Open orders endpoint failed: {e}")
+            report(f"❌ Open orders endpoint failed: {e}")
             return False
         
         # Test cancelling the order
         try:
             async with session.delete(f'http://localhost:8000/api/orders/{order_id}') as response:
-                data = await response.json()
-                print(f"✅ Order cancelled: {data['status']}")
+                data = await response.json(loads=orjson.loads)
+                report(f"✅ Order cancelled: {data['status']}")
         except Exception as e:
-            print(f"❌ Order cancellation failed: {e}")
+            report(f"❌ Order cancellation failed: {e}")
             return False
     
     return True
 
 async def test_websocket():
     """Test WebSocket connection"""
-    print("🔌 Testing WebSocket connection...")
+    report("🔌 Testing WebSocket connection...")
     
-    try:
-        async with websockets.connect('ws://localhost:8000/ws') as websocket:
-            print("✅ WebSocket connected")
+    async def receive_initial_messages():
+        # No permessage-deflate or client pings, and a small receive buffer
+        async with websockets.connect('ws://localhost:8000/ws', compression=None,
+                                      ping_interval=None, max_queue=8) as websocket:
+            report("✅ WebSocket connected")
             
             # Wait for initial messages
             for _ in range(3):
                 try:
                     message = await asyncio.wait_for(websocket.recv(), timeout=2)
-                    data = json.loads(message)
-                    print(f"✅ Received: {data['type']}")
+                    # Market data comes as binary msgpack frames, everything else as JSON
+                    data = msgpack.unpackb(message) if isinstance(message, bytes) else orjson.loads(message)
+                    report(f"✅ Received: {data['type']}")
                 except asyncio.TimeoutError:
                     break
-            
-            return True
+    
+    try:
+        # Overall budget for the whole test, so a stuck handshake cannot hang the run
+        await asyncio.wait_for(receive_initial_messages(), timeout=10)
+        return True
             
     except Exception as e:
-        print(f"❌ WebSocket test failed: {e}")
+        report(f"❌ WebSocket test failed: {e!r}")
         return False
 
 async def main():
@@ -116,6 +146,7 @@ async def main():
     # Run WebSocket tests  
     ws_success = await test_websocket()
     
+    sys.stdout.write("\n".join(results) + "\n")
     print("\n" + "=" * 50)
     if api_success and ws_success:
         print("🎉 All tests passed! Backend is working correctly.")
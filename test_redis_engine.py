@@ -0,0 +1,128 @@
+"""
+Differential test of the Redis matching engine against the in-memory one
+
+Replays the same random orders, cancels, updates and market data ticks on
+both engines and checks that they produce the same fills, order book and
+orders. Runs without a Redis server: needs fakeredis with Lua support
+(pip install "fakeredis[lua]").
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import fakeredis
+
+from models import Order, OrderType, OrderSide, BookLevel
+from order_matching import AsyncOrderMatchingEngine
+from redis_engine import RedisOrderMatchingEngine
+
+SEEDS = 40
+STEPS_PER_SEED = 400
+USERS = [f"user{i}" for i in range(6)]
+
+
+def fill_key(fills):
+    """Fills without their IDs, which each engine mints on its own"""
+    return [(f.buyer_order_id, f.seller_order_id, f.buyer_id, f.seller_id, f.quantity, f.price) for f in fills]
+
+
+def book_key(book: dict):
+    """Order book levels, with quantities rounded past float summation noise"""
+    return (
+        [(price, round(quantity, 9)) for price, quantity in book["bids"]],
+        [(price, round(quantity, 9)) for price, quantity in book["asks"]],
+        book["last_price"],
+    )
+
+
+def order_key(orders):
+    """Orders with the state both engines keep for them"""
+    return [(o.id, o.status, round(o.filled_quantity, 9), o.price, o.quantity, o.timestamp) for o in orders]
+
+
+async def run_seed(seed: int) -> list:
+    """Replay one random scenario on both engines and return the mismatches"""
+    rnd = random.Random(seed)
+    memory = AsyncOrderMatchingEngine()
+    redis = RedisOrderMatchingEngine(fakeredis.FakeAsyncRedis(decode_responses=True))
+    owners = {}
+    mismatches = []
+    
+    for step in range(STEPS_PER_SEED):
+        action = rnd.random()
+        if action < 0.55 or not owners:
+            order_type = OrderType.MARKET if rnd.random() < 0.15 else OrderType.LIMIT
+            fields = dict(
+                id=f"{seed}-O{step}",
+                user_id=rnd.choice(USERS),
+                symbol="BTCUSD",
+                order_type=order_type,
+                side=rnd.choice([OrderSide.BUY, OrderSide.SELL]),
+                quantity=rnd.randint(1, 50) / 10,
+                price=None if order_type is OrderType.MARKET else float(rnd.randint(90, 110)) + rnd.choice([0, 0.1, 0.3]),
+                timestamp=1_700_000_000_000_000_000 + step * 1_000_000_000,
+            )
+            owners[fields["id"]] = fields["user_id"]
+            expected = fill_key(await memory.process_order(Order(**fields)))
+            actual = fill_key(await redis.process_order(Order(**fields)))
+        elif action < 0.7:
+            order_id = rnd.choice(list(owners))
+            expected = await memory.cancel_order(order_id, owners[order_id])
+            actual = await redis.cancel_order(order_id, owners[order_id])
+        elif action < 0.8:
+            order_id = rnd.choice(list(owners))
+            new_price = float(rnd.randint(90, 110)) if rnd.random() < 0.7 else None
+            new_quantity = float(rnd.randint(1, 5)) if rnd.random() < 0.3 else None
+            expected = await memory.update_order(order_id, owners[order_id], new_price, new_quantity)
+            actual = await redis.update_order(order_id, owners[order_id], new_price, new_quantity)
+        else:
+            bid = float(rnd.randint(80, 105))
+            ask = bid + rnd.randint(1, 20)
+            bids, asks = ([BookLevel(bid, 1.0)], [BookLevel(ask, 1.0)]) if action < 0.9 else ([], [])
+            expected = fill_key(await memory.update_market_data(bids, asks))
+            actual = fill_key(await redis.update_market_data(bids, asks))
+        
+        if expected != actual:
+            mismatches.append(f"step {step}: {expected} != {actual}")
+        if book_key(await memory.get_order_book()) != book_key(await redis.get_order_book()):
+            mismatches.append(f"step {step}: order books differ")
+        if (await memory.get_best_bid(), await memory.get_best_ask()) != (await redis.get_best_bid(), await redis.get_best_ask()):
+            mismatches.append(f"step {step}: best prices differ")
+    
+    for user_id in USERS:
+        if order_key(await memory.get_user_orders(user_id)) != order_key(await redis.get_user_orders(user_id)):
+            mismatches.append(f"orders of {user_id} differ")
+        if fill_key(await memory.get_user_fills(user_id)) != fill_key(await redis.get_user_fills(user_id)):
+            mismatches.append(f"fills of {user_id} differ")
+    
+    return mismatches
+
+
+async def main():
+    """Run every seed and report the ones where the engines disagree"""
+    print("🧪 Comparing the Redis engine with the in-memory engine...")
+    
+    failed = 0
+    for seed in range(SEEDS):
+        mismatches = await run_seed(seed)
+        if mismatches:
+            failed += 1
+            print(f"❌ Seed {seed}: {len(mismatches)} mismatches, first: {mismatches[0]}")
+    
+    if failed:
+        print(f"❌ {failed} of {SEEDS} seeds failed")
+        return False
+    print(f"✅ Both engines agree on all {SEEDS} seeds")
+    return True
+
+
+if __name__ == "__main__":
+    # The engines log every fill at INFO
+    logging.disable(logging.INFO)
+    success = asyncio.run(main())
+    exit(0 if success else 1)